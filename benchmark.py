@@ -0,0 +1,631 @@
+"""
+    This program contains the benchmarks for GoldFire.  Run it from the folder that contains
+    fire_demo.py with the name of a benchmark and its options, for example:
+
+        python benchmark.py ring --readers 4 --seconds 5
+
+    To check the OpenGL benchmarks without a GPU, run them on Mesa's software rasterizer:
+
+        LIBGL_ALWAYS_SOFTWARE=1 python benchmark.py upload --headless
+
+    Each benchmark prints its results as a small table.  Benchmarks that also check for
+    correctness exit with a non-zero status if the check fails.
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import zlib
+from time import perf_counter, sleep
+
+def ring_writer(path, width, height, slots, rate, seconds, ready, results):
+    """
+        This function writes frames to a ring buffer at the given rate (or as fast as it can if
+        the rate is 0).  Every byte of a frame is set to the frame number (modulo 256) so the
+        readers can tell if a frame was torn.
+    """
+
+    from frame_ring import FrameRingWriter
+
+    ring = FrameRingWriter(path, width, height, slots)
+    interval = 1.0 / rate if rate else 0.0
+
+    index_bufs = [bytes([value]) * (width * height) for value in range(256)]
+    palettes = [bytes([value]) * 768 for value in range(256)]
+
+    ready.set()
+
+    frames, stop_time = 0, perf_counter() + seconds
+
+    start_time = perf_counter()
+
+    while perf_counter() < stop_time:
+        value = frames & 0xFF
+        ring.write(index_bufs[value], palettes[value])
+        frames += 1
+
+        if interval:
+            # Wait for the next frame like the display would.
+            sleep(max(0.0, start_time + frames * interval - perf_counter()))
+
+    results.put(('writer', frames, perf_counter() - start_time))
+
+    # Leave the file in place until the readers have detached.
+    ring.close(remove=False)
+
+def ring_reader(path, seconds, results):
+    """
+        This function reads the newest frame from a ring buffer in place as fast as it can and
+        checks that every frame it accepted was complete.  The whole slot is checksummed (in
+        place) before the sequence check, so a write that overlaps any part of the read is
+        caught.
+    """
+
+    from frame_ring import FrameRingReader
+
+    ring = FrameRingReader(path)
+
+    reads = torn = 0
+    last = None
+
+    # The checksum of each complete frame, worked out the first time it is needed.
+    checksums = {}
+    stop_time = perf_counter() + seconds
+
+    start_time = perf_counter()
+
+    while perf_counter() < stop_time:
+        frame = ring.latest()
+
+        if frame is None:
+            continue
+
+        index, palette = frame['index'], frame['palette']
+
+        if frame['frame'] != last:
+            checksum = zlib.crc32(palette, zlib.crc32(index))
+
+            if ring.is_current(frame['frame']):
+                reads += 1
+                last = frame['frame']
+                value = frame['frame'] & 0xFF
+
+                if value not in checksums:
+                    checksums[value] = zlib.crc32(bytes([value]) * 768,
+                                                  zlib.crc32(bytes([value]) * len(index)))
+
+                if checksum != checksums[value]:
+                    # The frame passed the sequence check but was not complete.
+                    torn += 1
+            else:
+                ring.retries += 1
+
+        index.release()
+        palette.release()
+
+    results.put(('reader', reads, perf_counter() - start_time, ring.retries, torn))
+
+    ring.close()
+
+def bench_ring(args):
+    """
+        This function measures the throughput of the shared memory frame ring with 1 to N
+        readers and checks for torn reads.
+    """
+
+    path = os.path.join(tempfile.gettempdir(), f'goldfire_bench_{os.getpid()}.ring')
+
+    print(f'Frame: {args.width}x{args.height}, slots: {args.slots}, seconds: {args.seconds}, '
+          f'rate: {args.rate or "unlimited"}')
+    print(f'{"readers":>7} {"writes/s":>10} {"MB/s":>8} {"reads/s":>10} '
+          f'{"retries":>8} {"torn":>6}')
+
+    total_torn = 0
+
+    for readers in range(1, args.readers + 1):
+        ready, results = multiprocessing.Event(), multiprocessing.Queue()
+
+        writer = multiprocessing.Process(
+            target=ring_writer,
+            args=(path, args.width, args.height, args.slots, args.rate, args.seconds + 0.5,
+                  ready, results))
+        writer.start()
+        ready.wait()
+
+        procs = [multiprocessing.Process(target=ring_reader, args=(path, args.seconds, results))
+                 for _ in range(readers)]
+
+        for proc in procs:
+            proc.start()
+
+        stats = [results.get() for _ in range(readers + 1)]
+
+        for proc in procs + [writer]:
+            proc.join()
+
+        os.remove(path)
+
+        _, writes, elapsed = next(stat for stat in stats if stat[0] == 'writer')
+        reader_stats = [stat for stat in stats if stat[0] == 'reader']
+
+        reads = sum(stat[1] / stat[2] for stat in reader_stats) / readers
+        retries = sum(stat[3] for stat in reader_stats)
+        torn = sum(stat[4] for stat in reader_stats)
+        total_torn += torn
+
+        frame_mb = (args.width * args.height + 768) / 1_000_000
+
+        print(f'{readers:>7} {writes / elapsed:>10.0f} {writes / elapsed * frame_mb:>8.1f} '
+              f'{reads:>10.0f} {retries:>8} {torn:>6}')
+
+    if total_torn:
+        print(f'FAILED: {total_torn} torn frames were accepted')
+
+        return 1
+
+    print('No torn frames were accepted')
+
+    return 0
+
+def create_context(width, height, headless):
+    """
+        This function creates an OpenGL context of the given size.  Normally a GLUT window is
+        used, the same as GoldFire.  With headless, an off-screen EGL context is used instead so
+        the benchmark can run without a display (e.g. on Mesa's software rasterizer).
+    """
+
+    if headless:
+        import ctypes
+        from OpenGL import EGL
+
+        display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        EGL.eglInitialize(display, None, None)
+
+        attributes = (EGL.EGLint * 7)(EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+                                      EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                                      EGL.EGL_RED_SIZE, 8, EGL.EGL_NONE)
+        config, count = EGL.EGLConfig(), EGL.EGLint()
+        EGL.eglChooseConfig(display, attributes, ctypes.pointer(config), 1, ctypes.pointer(count))
+
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, None)
+
+        size = (EGL.EGLint * 5)(EGL.EGL_WIDTH, width, EGL.EGL_HEIGHT, height, EGL.EGL_NONE)
+        surface = EGL.eglCreatePbufferSurface(display, config, size)
+        EGL.eglMakeCurrent(display, surface, surface, context)
+
+        def destroy():
+            # Release the context before destroying it and its surface so a context isn't
+            # left behind for every resolution.
+            EGL.eglMakeCurrent(display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE,
+                               EGL.EGL_NO_CONTEXT)
+            EGL.eglDestroySurface(display, surface)
+            EGL.eglDestroyContext(display, context)
+
+        return destroy
+
+    import OpenGL.GLUT as glut
+
+    glut.glutInit()
+    glut.glutInitDisplayMode(glut.GLUT_RGB)
+    glut.glutInitWindowSize(width, height)
+    handle = glut.glutCreateWindow(b'GoldFire Benchmark')
+
+    return lambda: glut.glutDestroyWindow(handle)
+
+def time_frames(frames, upload, draw, finish):
+    """
+        This function returns the average time in milliseconds to upload and draw a frame,
+        first for just the calls and then including the time for OpenGL to finish the work.
+    """
+
+    calls = total = 0.0
+
+    for frame in frames[:5]:
+        # Warm up so that allocations made by the first calls are not counted.
+        upload(frame)
+        draw()
+
+    finish()
+
+    for frame in frames:
+        start_time = perf_counter()
+        upload(frame)
+        draw()
+        calls += perf_counter() - start_time
+        finish()
+        total += perf_counter() - start_time
+
+    return calls * 1000 / len(frames), total * 1000 / len(frames)
+
+def bench_upload(args):
+    """
+        This function compares the cost per frame of glDrawPixels with streaming the frame
+        through pixel buffer objects at several resolutions.
+    """
+
+    if args.headless:
+        # This has to be set before OpenGL is imported.
+        os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+        os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+
+    import numpy as np
+    import OpenGL.GL as gl
+    from gl_stream import TextureStreamer
+
+    print(f'{"resolution":>10} {"path":>16} {"source":>10} {"calls ms":>9} {"total ms":>9}')
+
+    for resolution in args.resolutions:
+        width, height = (int(value) for value in resolution.split('x'))
+        destroy = create_context(width, height, args.headless)
+
+        gl.glViewport(0, 0, width, height)
+        gl.glLoadIdentity()
+        gl.glRasterPos2f(-1, 1)
+        gl.glPixelZoom(1, -1)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+
+        # Use a few different frames so nothing can be cached between calls.
+        arrays = [np.random.randint(0, 256, width * height * 3, dtype=np.uint8)
+                  for _ in range(4)]
+        sources = {
+            'bytearray': [bytearray(arrays[index % 4].tobytes()) for index in range(args.frames)],
+            'numpy': [arrays[index % 4] for index in range(args.frames)]
+        }
+
+        for source, frames in sources.items():
+            results = {
+                'glDrawPixels': time_frames(
+                    frames,
+                    lambda frame, width=width, height=height: gl.glDrawPixels(
+                        width, height, gl.GL_RGB, gl.GL_UNSIGNED_BYTE, frame),
+                    lambda: None,
+                    gl.glFinish)
+            }
+
+            for mode in ('map', 'orphan'):
+                streamer = TextureStreamer(width, height, args.buffers, mode)
+                results[f'pbo {mode}'] = time_frames(frames, streamer.upload, streamer.draw,
+                                                     gl.glFinish)
+                streamer.delete()
+
+            for path, (calls, total) in results.items():
+                print(f'{resolution:>10} {path:>16} {source:>10} {calls:>9.3f} {total:>9.3f}')
+
+        destroy()
+
+    return 0
+
+def bench_composite(args):
+    """
+        This function compares the CPU time and upload size per frame of building the whole
+        bitmap and drawing it with glDrawPixels against compositing the fire and words on the
+        GPU.  The simulation step itself is not included since it is the same for both.
+    """
+
+    if args.headless:
+        # This has to be set before OpenGL is imported.
+        os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+        os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+
+    import OpenGL.GL as gl
+    from fire_demo import Fire
+    from gl_stream import LayerCompositor
+
+    fire = Fire()
+    width, height = fire.geometry.w, fire.geometry.h
+    destroy = create_context(width, height, args.headless)
+
+    gl.glViewport(0, 0, width, height)
+    gl.glLoadIdentity()
+    gl.glRasterPos2f(-1, 1)
+    gl.glPixelZoom(1, -1)
+
+    compositor = LayerCompositor(width, height, fire.geometry.first_row,
+                                 fire.geometry.logo_rect)
+
+    def draw_pixels():
+        gl.glDrawPixels(width, height, gl.GL_RGB, gl.GL_UNSIGNED_BYTE, fire.render_frame())
+
+    def composite():
+        fire.composite_frame()
+        compositor.draw()
+
+    results = {}
+
+    for path, draw in (('glDrawPixels', draw_pixels), ('composite', composite)):
+        # Start each path from the same place with the words needing to be built.
+        fire.compositor = compositor if path == 'composite' else None
+        fire.frame_state.palette_changed = True
+        bytes_before = compositor.layers['uploaded_bytes']
+
+        for _ in range(60):
+            fire.step_fire()
+
+        elapsed = 0.0
+
+        for _ in range(args.frames):
+            fire.step_fire()
+
+            start_time = perf_counter()
+            draw()
+            gl.glFinish()
+            elapsed += perf_counter() - start_time
+
+        uploaded = compositor.layers['uploaded_bytes'] - bytes_before \
+            if path == 'composite' else width * height * 3 * args.frames
+
+        results[path] = (elapsed * 1000 / args.frames, uploaded / args.frames)
+
+    destroy()
+
+    print(f'{"path":>12} {"ms / frame":>11} {"bytes / frame":>14}')
+
+    for path, (elapsed, uploaded) in results.items():
+        print(f'{path:>12} {elapsed:>11.3f} {uploaded:>14.0f}')
+
+    print(f'CPU time: {results["composite"][0] / results["glDrawPixels"][0]:.1%}, '
+          f'upload: {results["composite"][1] / results["glDrawPixels"][1]:.1%} '
+          f'of glDrawPixels')
+
+    return 0
+
+def bench_engines(args):
+    """
+        This function compares the frames per second of the pixel loops (python) with the
+        standard library engine (stdlib).  Only the simulation step and the bitmap are timed,
+        OpenGL is not involved.
+    """
+
+    from fire_demo import Fire
+
+    print(f'{"engine":>8} {"step ms":>8} {"render ms":>10} {"FPS":>8}')
+
+    results = {}
+
+    for engine in ('python', 'stdlib'):
+        fire = Fire(engine=engine)
+
+        for _ in range(60):
+            # Let the fire build up first.
+            fire.make_frame()
+
+        step_time = render_time = 0.0
+
+        for _ in range(args.frames):
+            start_time = perf_counter()
+            fire.step_fire()
+            step_time += perf_counter() - start_time
+
+            start_time = perf_counter()
+            fire.render_frame()
+            render_time += perf_counter() - start_time
+
+        results[engine] = args.frames / (step_time + render_time)
+
+        print(f'{engine:>8} {step_time * 1000 / args.frames:>8.3f} '
+              f'{render_time * 1000 / args.frames:>10.3f} {results[engine]:>8.1f}')
+
+    print(f'stdlib is {results["stdlib"] / results["python"]:.1f}x the FPS of python')
+
+    return 0
+
+def bench_threads(args):
+    """
+        This function measures how the threaded engine scales from one thread up to the given
+        number at each resolution.  The speedup is relative to one thread and the efficiency is
+        the speedup divided by the number of threads.  The band of fire is FIRE_ROWS high at
+        every resolution (see state.Geometry), the same as the band that --engine threads
+        simulates.
+    """
+
+    from state import Geometry
+    from threaded_engine import ThreadedEngine, gil_enabled
+
+    print(f'GIL: {"enabled" if gil_enabled() else "disabled"}, CPUs: {os.cpu_count()}')
+    print(f'{"resolution":>10} {"threads":>8} {"step ms":>8} {"render ms":>10} {"FPS":>8} '
+          f'{"speedup":>8} {"efficiency":>11}')
+
+    for resolution in args.resolutions:
+        width, height = (int(size) for size in resolution.split('x'))
+
+        # A logo half the width of the window.
+        geometry = Geometry(width, height, width // 2)
+        words_buf = bytes(range(256)) * (width // 2 * 20 * 3 // 256 + 1)
+        words_buf = words_buf[:width // 2 * 20 * 3]
+        palette = bytes(range(256)) * 3
+
+        base_fps = None
+
+        for threads in range(1, args.threads + 1):
+            engine = ThreadedEngine(geometry, threads)
+            back_buf = bytearray(width * height)
+
+            for _ in range(60):
+                # Let the fire build up first.
+                engine.step(back_buf)
+
+            step_time = render_time = 0.0
+
+            for _ in range(args.frames):
+                start_time = perf_counter()
+                engine.step(back_buf)
+                step_time += perf_counter() - start_time
+
+                start_time = perf_counter()
+                engine.render(bytearray(width * height * 3), back_buf, palette, words_buf)
+                render_time += perf_counter() - start_time
+
+            engine.close()
+
+            fps = args.frames / (step_time + render_time)
+            base_fps = base_fps or fps
+
+            print(f'{resolution:>10} {threads:>8} {step_time * 1000 / args.frames:>8.3f} '
+                  f'{render_time * 1000 / args.frames:>10.3f} {fps:>8.1f} '
+                  f'{fps / base_fps:>7.2f}x {fps / base_fps / threads:>11.1%}')
+
+    return 0
+
+def state_dicts_frame(window, logo, fps, timing, words_buf, display_buf):
+    """
+        This function does the bookkeeping of a frame the way it was done with dicts, working
+        out the offsets every frame.
+    """
+
+    window_w = window['w']
+
+    # The offsets the frame path worked out every frame.
+    _ = window['first_row'] * window['w'], \
+        (window['h'] - 1) * window['w'] + window['w'], \
+        (window['h'] - window['first_row']) * window_w
+
+    logo_cols = logo['logo_cols'] * 3
+    buf_start = logo['start_row'] * window_w * 3 + logo['start_col'] * 3
+    words_start = 0
+
+    for _ in range(0, 20):
+        display_buf[buf_start:buf_start + logo_cols] \
+            = words_buf[words_start:words_start + logo_cols]
+
+        buf_start += window_w * 3
+        words_start += logo_cols
+
+    timing['renders'] += 1
+    fps['frames'] += 1
+
+def state_slots_frame(geometry, frame_state, words_buf, display_buf):
+    """ This function does the same bookkeeping with a Geometry and a FrameState. """
+
+    _ = geometry.start_from, geometry.end_from, geometry.mirror_from
+
+    logo_cols = geometry.logo_bytes
+
+    for buf_start, words_start in geometry.logo_rows:
+        display_buf[buf_start:buf_start + logo_cols] \
+            = words_buf[words_start:words_start + logo_cols]
+
+    frame_state.renders += 1
+    frame_state.frames += 1
+
+def bench_state(args):
+    """
+        This function measures the bookkeeping that each frame does outside of the pixel work:
+        looking up the size and logo placement, working out the offsets (including the ones
+        for every row of the logo), and counting the frame.  It is done once with dicts and
+        offsets worked out every frame (as before) and once with the slotted Geometry and
+        FrameState.  The same rows of the logo are copied both ways.  The time saved is also
+        shown as a share of a whole stdlib engine frame at the same size.
+    """
+
+    from fire_demo import Fire
+    from state import FrameState, Geometry
+
+    print(f'{"resolution":>10} {"dicts us":>9} {"slots us":>9} {"saved us":>9} '
+          f'{"frame ms":>9} {"saved":>7}')
+
+    for resolution in args.resolutions:
+        width, height = (int(size) for size in resolution.split('x'))
+
+        geometry = Geometry(width, height, 144)
+        frame_state = FrameState(70)
+
+        window = {'handle': None, 'w': width, 'h': height, 'first_row': geometry.first_row,
+                  'size': geometry.size}
+        logo = {'start_row': geometry.logo_start_row, 'start_col': geometry.logo_start_col,
+                'logo_cols': geometry.logo_cols}
+        fps, timing = {'frames': 0}, {'renders': 0}
+
+        words_buf = bytes(geometry.logo_bytes * 20)
+        display_buf = bytearray(geometry.size * 3)
+
+        results = {}
+
+        for name, frame, frame_args in (
+                ('dicts', state_dicts_frame, (window, logo, fps, timing, words_buf, display_buf)),
+                ('slots', state_slots_frame, (geometry, frame_state, words_buf, display_buf))):
+            # Take the best of a few runs to leave out noise from the rest of the system.
+            best = None
+
+            for _ in range(5):
+                start_time = perf_counter()
+
+                for _ in range(args.frames):
+                    frame(*frame_args)
+
+                elapsed = (perf_counter() - start_time) / args.frames
+                best = elapsed if best is None else min(best, elapsed)
+
+            results[name] = best
+
+        fire = Fire(engine='stdlib', size=(width, height))
+        start_time = perf_counter()
+
+        for _ in range(50):
+            fire.make_frame()
+
+        frame_time = (perf_counter() - start_time) / 50
+        saved = results['dicts'] - results['slots']
+
+        print(f'{resolution:>10} {results["dicts"] * 1e6:>9.2f} {results["slots"] * 1e6:>9.2f} '
+              f'{saved * 1e6:>9.2f} {frame_time * 1000:>9.3f} {saved / frame_time:>7.2%}')
+
+    return 0
+
+def parse_args():
+    """ This function parses the command line arguments. """
+
+    parser = argparse.ArgumentParser(description='GoldFire benchmarks')
+    benchmarks = parser.add_subparsers(dest='benchmark', required=True)
+
+    ring = benchmarks.add_parser('ring', help='shared memory frame ring throughput')
+    ring.add_argument('--readers', type=int, default=4, help='maximum number of readers')
+    ring.add_argument('--seconds', type=float, default=3, help='seconds per run')
+    ring.add_argument('--width', type=int, default=320)
+    ring.add_argument('--height', type=int, default=200)
+    ring.add_argument('--slots', type=int, default=4)
+    ring.add_argument('--rate', type=float, default=0,
+                      help='frames written per second (0 for as fast as possible)')
+    ring.set_defaults(func=bench_ring)
+
+    upload = benchmarks.add_parser('upload', help='glDrawPixels against pixel buffer objects')
+    upload.add_argument('--resolutions', nargs='+', default=['320x200', '640x400', '1280x800',
+                                                              '1920x1080'])
+    upload.add_argument('--frames', type=int, default=200, help='frames per measurement')
+    upload.add_argument('--buffers', type=int, default=3, help='number of pixel buffers')
+    upload.add_argument('--headless', action='store_true',
+                        help='use an off-screen EGL context instead of a window')
+    upload.set_defaults(func=bench_upload)
+
+    composite = benchmarks.add_parser('composite',
+                                      help='whole bitmap against compositing on the GPU')
+    composite.add_argument('--frames', type=int, default=200, help='frames to measure')
+    composite.add_argument('--headless', action='store_true',
+                           help='use an off-screen EGL context instead of a window')
+    composite.set_defaults(func=bench_composite)
+
+    engines = benchmarks.add_parser('engines', help='pixel loops against the stdlib engine')
+    engines.add_argument('--frames', type=int, default=300, help='frames to measure')
+    engines.set_defaults(func=bench_engines)
+
+    threads = benchmarks.add_parser('threads', help='scaling of the threaded engine')
+    threads.add_argument('--resolutions', nargs='+', default=['320x200', '640x400', '1280x800',
+                                                               '1920x1080'])
+    threads.add_argument('--threads', type=int, default=os.cpu_count() or 1,
+                         help='largest number of threads')
+    threads.add_argument('--frames', type=int, default=200, help='frames per measurement')
+    threads.set_defaults(func=bench_threads)
+
+    state = benchmarks.add_parser('state', help='dicts against slotted state in the frame path')
+    state.add_argument('--resolutions', nargs='+', default=['320x200', '384x240', '640x400',
+                                                             '1280x800'])
+    state.add_argument('--frames', type=int, default=20000, help='frames per measurement')
+    state.set_defaults(func=bench_state)
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    ARGS = parse_args()
+    sys.exit(ARGS.func(ARGS))
@@ -0,0 +1,277 @@
+"""
+    This module adds heat to the fire at points, along lines, or over shapes, for the mouse
+    (or touch or sensor input) to draw with.
+
+    Every emitter has an intensity (the palette index it heats its pixels to, 128 is as hot as
+    the random data at the bottom of the fire) and a decay (what the intensity is multiplied by
+    after each simulation step, 1.0 for an emitter that never fades).  Emitters that have faded
+    out are removed.
+
+    The emitters are not kept as objects.  All of their pixels are kept in one array with a
+    second array that says which emitter each pixel belongs to, so every emitter is applied to
+    the back buffer with a handful of NumPy operations per step no matter how many there are.
+    New emitters are collected and merged into the arrays once per step.
+
+    The fire is normally only simulated from the first row of fire down.  Heat from an emitter
+    above that would never move, so the rows above the first row of fire are simulated and
+    drawn as well while they have heat in them.  The top of this active area grows by a row
+    each step while its top row is hot and shrinks back by a row each step once it is cold.
+    The active area is simulated on its own as if the rows below it were cold.  Otherwise the
+    fire itself, which is still warm at the first row of fire, would climb the whole window.
+"""
+
+import numpy as np
+
+from threaded_engine import average
+
+def brush(radius):
+    """ This function returns the x and y offsets of the pixels in a disc of a radius. """
+
+    y_offsets, x_offsets = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    inside = x_offsets * x_offsets + y_offsets * y_offsets <= radius * radius
+
+    return x_offsets[inside], y_offsets[inside]
+
+class Emitters:
+    """
+        This class keeps the emitters for a window of the given geometry (see state.py) and
+        applies them to the back buffer, which can be a list or a bytearray.
+    """
+
+    def __init__(self, geometry):
+        self.geometry = geometry
+
+        # The pixels of every emitter (as indices into the back buffer) and the emitter each
+        # of them belongs to.
+        self.pixels = np.zeros(0, dtype=np.int64)
+        self.owner = np.zeros(0, dtype=np.int64)
+
+        # The id, intensity, and decay of every emitter.
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.intensity = np.zeros(0, dtype=np.float32)
+        self.decay = np.zeros(0, dtype=np.float32)
+
+        # The emitters added since the last step.
+        self.pending = []
+        self.next_id = 0
+
+        # The top row that is simulated.  It only moves above the first row of fire when there
+        # is heat up there.
+        self.active_row = geometry.first_row
+
+    def __len__(self):
+        return len(self.ids) + sum(len(pending[2]) for pending in self.pending)
+
+    def add_points(self, x_pos, y_pos, intensity=128, decay=1.0, radius=0):
+        """
+            This method adds an emitter at each of the points (window coordinates) and returns
+            their ids.  Many points can be added in one call.
+        """
+
+        x_pos, y_pos = np.atleast_1d(x_pos), np.atleast_1d(y_pos)
+        x_offsets, y_offsets = brush(radius)
+
+        return self.append((x_pos[:, None] + x_offsets).ravel(),
+                           (y_pos[:, None] + y_offsets).ravel(),
+                           np.repeat(np.arange(len(x_pos)), len(x_offsets)),
+                           len(x_pos), intensity, decay)
+
+    def add_line(self, start, end, intensity=128, decay=1.0, radius=0):
+        """ This method adds one emitter along a line between two points and returns its id. """
+
+        steps = max(abs(end[0] - start[0]), abs(end[1] - start[1])) + 1
+
+        return self.add_shape(np.stack((np.rint(np.linspace(start[0], end[0], steps)),
+                                        np.rint(np.linspace(start[1], end[1], steps))), axis=1),
+                              intensity, decay, radius)
+
+    def add_shape(self, points, intensity=128, decay=1.0, radius=0):
+        """
+            This method adds one emitter that covers a list of points (or an array of x, y
+            pairs) and returns its id.
+        """
+
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        x_offsets, y_offsets = brush(radius)
+
+        x_pos = (points[:, 0:1] + x_offsets).ravel()
+        y_pos = (points[:, 1:2] + y_offsets).ravel()
+
+        return self.append(x_pos, y_pos, np.zeros(len(x_pos), dtype=np.int64), 1, intensity,
+                           decay)[0]
+
+    def append(self, x_pos, y_pos, owner, count, intensity, decay):
+        """
+            This method queues new emitters.  The owner of each point is counted from 0 for
+            the first new emitter.  Points outside the window are dropped.
+        """
+
+        window_w, window_h = self.geometry.w, self.geometry.h
+        inside = (x_pos >= 0) & (x_pos < window_w) & (y_pos >= 0) & (y_pos < window_h)
+
+        ids = np.arange(self.next_id, self.next_id + count)
+        self.next_id += count
+
+        self.pending.append((y_pos[inside] * window_w + x_pos[inside], owner[inside], ids,
+                             np.full(count, min(intensity, 255), dtype=np.float32),
+                             np.full(count, decay, dtype=np.float32)))
+
+        return ids
+
+    def remove(self, emitter_id):
+        """ This method removes an emitter.  It is gone after the next step. """
+
+        self.merge()
+        self.intensity[self.ids == emitter_id] = 0
+
+    def clear(self):
+        """ This method removes every emitter. """
+
+        self.pending = []
+        self.pixels, self.owner = self.pixels[:0], self.owner[:0]
+        self.ids, self.intensity, self.decay = self.ids[:0], self.intensity[:0], self.decay[:0]
+
+    def merge(self):
+        """ This method adds the queued emitters to the arrays. """
+
+        if not self.pending:
+            return
+
+        # Number the owners of the new points after the existing emitters.
+        count = len(self.ids)
+        owners = [self.owner]
+
+        for _, owner, ids, _, _ in self.pending:
+            owners.append(owner + count)
+            count += len(ids)
+
+        self.pixels = np.concatenate([self.pixels] + [pending[0] for pending in self.pending])
+        self.owner = np.concatenate(owners)
+        self.ids = np.concatenate([self.ids] + [pending[2] for pending in self.pending])
+        self.intensity = np.concatenate([self.intensity]
+                                        + [pending[3] for pending in self.pending])
+        self.decay = np.concatenate([self.decay] + [pending[4] for pending in self.pending])
+
+        self.pending = []
+
+    def apply(self, back_buf):
+        """
+            This method heats the pixels of every emitter to at least its intensity, fades the
+            emitters, and moves the top of the active area.  It is called once per simulation
+            step, after the step.
+        """
+
+        self.merge()
+
+        if len(self.pixels):
+            window_w = self.geometry.w
+
+            # Only the rows that the emitters touch are converted when the back buffer is a
+            # list.
+            start, end = self.pixels.min() // window_w * window_w, \
+                (self.pixels.max() // window_w + 1) * window_w
+            heat = rows_view(back_buf, start, end)
+
+            # Where emitters overlap, the hottest one wins.
+            np.maximum.at(heat, self.pixels - start, self.intensity.astype(np.uint8)[self.owner])
+
+            if not isinstance(back_buf, bytearray):
+                back_buf[start:end] = heat.tolist()
+
+            # Make sure the active area reaches the emitters above the first row of fire.
+            self.active_row = min(self.active_row, int(self.pixels.min()) // window_w)
+
+            self.fade()
+
+        self.track(back_buf)
+
+    def fade(self):
+        """ This method fades the emitters and removes the ones that have gone out. """
+
+        self.intensity *= self.decay
+        lit = self.intensity >= 1
+
+        if lit.all():
+            return
+
+        # Renumber the emitters that are left and drop the pixels of the others.
+        renumbered = np.cumsum(lit) - 1
+        kept = lit[self.owner]
+
+        self.pixels, self.owner = self.pixels[kept], renumbered[self.owner[kept]]
+        self.ids, self.intensity, self.decay = self.ids[lit], self.intensity[lit], self.decay[lit]
+
+    def track(self, back_buf):
+        """
+            This method moves the top of the active area up a row if its top row has heat in it
+            and down a row if it doesn't.  Once there is no heat above the first row of fire,
+            the fire is left exactly as it always was.
+        """
+
+        window_w, first_row = self.geometry.w, self.geometry.first_row
+        top = self.active_row
+
+        if top >= first_row:
+            return
+
+        if any(back_buf[top * window_w:top * window_w + window_w]):
+            self.active_row = max(top - 1, 0)
+        elif top < first_row:
+            self.active_row = top + 1
+
+    def step_above(self, back_buf):
+        """
+            This method advances the rows between the top of the active area and the first row
+            of fire.  The two rows below the active area are taken to be cold.
+        """
+
+        window_w, first_row = self.geometry.w, self.geometry.first_row
+        top = self.active_row
+
+        if top >= first_row:
+            return
+
+        start, end = top * window_w, first_row * window_w
+        rows = rows_view(back_buf, start, end).reshape(-1, window_w)
+
+        below = np.zeros((len(rows) + 2, window_w), dtype=np.uint8)
+        below[:len(rows)] = rows
+        scratch = np.empty((3, len(rows), window_w), dtype=np.uint16)
+
+        average(below[1:-1], below[2:], rows, scratch[0], scratch[1], scratch[2])
+
+        if not isinstance(back_buf, bytearray):
+            back_buf[start:end] = rows.ravel().tolist()
+
+    def render_above(self, display_buf, back_buf, palette):
+        """
+            This method draws the heat in the active area above the first row of fire in place,
+            over the mirrored fire and the words.  Pixels without heat are left alone.
+        """
+
+        window_w, first_row = self.geometry.w, self.geometry.first_row
+        top = self.active_row
+
+        if top >= first_row:
+            return display_buf
+
+        start, end = top * window_w, first_row * window_w
+        heat = rows_view(back_buf, start, end)
+        hot = np.flatnonzero(heat)
+
+        display = np.frombuffer(display_buf, dtype=np.uint8).reshape(-1, 3)
+        display[start + hot] = np.frombuffer(bytes(palette), dtype=np.uint8).reshape(256, 3)[
+            heat[hot]]
+
+        return display_buf
+
+def rows_view(back_buf, start, end):
+    """
+        This function returns part of the back buffer as an array.  For a bytearray, this is a
+        view that changes the back buffer.  For a list, it is a copy.
+    """
+
+    if isinstance(back_buf, bytearray):
+        return np.frombuffer(back_buf, dtype=np.uint8)[start:end]
+
+    return np.array(back_buf[start:end], dtype=np.uint8)
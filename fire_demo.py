@@ -12,12 +12,25 @@
 """
 
 import os
-from time import perf_counter
+from time import perf_counter, strftime
+import argparse
+import collections
 import glob
+import math
 import random
-import numpy as np
+try:
+    import numpy as np
+except ImportError:
+    # NumPy is optional.  Without it, the random data comes from the random module.
+    np = None
 import OpenGL.GL as gl
 import OpenGL.GLUT as glut
+from frame_ring import FrameRingWriter, default_path
+from gl_stream import LayerCompositor, TextureStreamer
+from recorder import Recorder, Recording
+from state import FrameState, Geometry
+from stats import percentile
+from stdlib_engine import StdlibEngine, colorize
 
 class Fire:
     """
@@ -69,64 +82,205 @@ class Fire:
 
         * Assigning multiple values in one statement yields a slight speed improvement.  It also
           reduces the number of statements which makes pylint happy.
+
+        * Working on whole rows instead of pixels is several times faster again (see
+          stdlib_engine.py and --engine stdlib).  Python integers make good wide registers and
+          bytes.translate is a palette lookup for a whole band at once.
+
+        * The row operations can also be split into bands and spread over a pool of threads
+          (see threaded_engine.py and --engine threads).  NumPy releases the GIL while it works,
+          so the bands run in parallel even on a standard build once the window is big enough.
+
+        * The palettes of a crossfade are calculated in bulk when it starts (with NumPy if it
+          is installed) and the rotations of every palette for cycling are calculated once
+          when the palettes load (see make_blend_table and make_cycle_table).  The words and
+          black pixels for each step are built the first time the step is shown and kept, so
+          starting a transition doesn't hold up a frame and each frame of a transition only
+          swaps in a different 256 entry palette and a different copy of the words.
+
+        * The sizes and offsets used by each frame (including the offset of every row of the
+          logo) are worked out once per screen mode in a Geometry (see state.py) instead of being
+          looked up in dicts and re-calculated every frame.  The gain is small next to the pixel
+          work but it is free.
+
+        * The simulation runs on a fixed timestep (sim_rate steps per second) that is independent
+          of the display rate.  The original was locked to the scanline refresh, so this allows
+          the original look to be reproduced and keeps fast displays from wasting time on
+          simulation steps that would never be seen.  When the display is faster than the
+          simulation, the last frame is kept on the screen (it is only drawn again if the window
+          needs repainting) and the display waits for the next step.
     """
 
-    def __init__(self):
-        # Setup the starting time and frames for determing the fps.  The time
-        # will be initialized later.
-        self.fps = {
-            'start_time': None,
-            'frames': 0
-        }
+    def __init__(self, sim_rate=70, fade_steps=35, backend='pixels', engine='python',
+                 threads=4, brush_intensity=128, brush_decay=0.85, size=(320, 200)):
+        # Setup the starting time and frames for determing the fps and the fixed timestep.  A
+        # rate of 0 (or None) advances the fire one step per displayed frame, which ties the
+        # speed of the fire to the speed of the display.  The times will be initialized later.
+        self.frame_state = FrameState(sim_rate)
 
-        # Initialize the window handle, dimensions, first row of fire, and size.
-        self.window = {
-            'handle': None,
-            'w': 320, # 384,
-            'h': 200, # 240,
-            'first_row': 145,
-            'size': 0
-        }
+        # The OpenGL window handle.
+        self.handle = None
 
-        self.window['size'] = self.window['w'] * self.window['h']
+        # Read the logo and work out the dimensions, the first row of fire, and where the
+        # logo goes (see state.py).  The other size is 384x240.
+        self.logo = read_logo()
+        self.geometry = Geometry(size[0], size[1], len(self.logo) // 20)
 
-        self.start_from = self.window['first_row'] * self.window['w']
-        self.end_from = (self.window['h'] - 1) * self.window['w'] + self.window['w']
-
-        # Setup the palette index, grey flag, the changed flag, and the number of palettes.
+        # Setup the palette index, grey flag, and the number of palettes.  The flag for a changed
+        # palette is in the frame state since every frame reads it.
         self.palette_flags = {
             'index': 0,
             'grey': False,
             'fire_grey': False,
             'words_grey': False,
-            'changed': True,
             'total': 0,
+            'fade_steps': fade_steps,
+            'cycle': False
         }
 
         # Initialize the palettes.
         self.palettes, self.greys, self.black_pixels = read_palettes()
         self.palette_flags['total'] = len(self.palettes)
 
-        # Store the logo information.
-        self.logo = self.pre_process_logo()
+        # Every rotation of every palette (color and grey) for cycling, by palette.  Palettes
+        # that are not loaded from disk (from a recording) are added the first time they cycle.
+        self.cycles = {}
+
+        for palette in self.palettes + self.greys:
+            self.cycle_table(palette)
 
         # Copy the default palette into the current palette.
         self.current_words_palette = self.palettes[self.palette_flags['index']].copy()
         self.current_fire_palette = self.palettes[self.palette_flags['index']].copy()
+        self.current_black = self.black_pixels[self.palette_flags['index']]
 
-        # Initialize the back buffer. The back buffer only has
-        # the palette lookup value, so it is only a 1/4 of the size.
-        self.back_buf = [0x00] * self.window['size']
+        # The back buffer, the engines, and the emitters are created for the geometry by
+        # create_buffers.  The standard library engine works on whole rows of a bytearray
+        # instead of pixels of a list (see stdlib_engine.py).  The threaded engine splits each
+        # frame into bands that a pool of threads works on with NumPy (see threaded_engine.py).
+        # The heat emitters that the mouse draws with (see emitters.py) need NumPy.
+        self.engine, self.threads = engine, threads
+        self.back_buf = None
+        self.stdlib = None
+        self.threaded = None
+        self.emitters = None
+
+        self.create_buffers()
 
         self.cached = create_cache()
 
         self.words_buf = None
 
+        # The palette transition (crossfade or cycle) that is in progress, if any.
+        self.sequence = None
+
         self.display_word = False
 
+        # Dragging with the left button draws fading strokes, the right button places a
+        # steady emitter.  The last point is where the stroke continues from.
+        self.brush = {
+            'intensity': brush_intensity,
+            'decay': brush_decay,
+            'radius': 2,
+            'last': None
+        }
+
+        # Key presses are queued as they come in and applied together once per frame, so a
+        # burst of palette keys only changes the palettes once.  The events applied since the
+        # last rendered frame wait there for their latency (event to presented frame) to be
+        # traced.
+        self.keys = {
+            'queue': [],
+            'change': False,
+            'waiting': [],
+            'latency': collections.deque(maxlen=10000),
+            'events': 0,
+            'changes': 0
+        }
+
+        # The last frame that was rendered.  This is re-used when no simulation step was due.
+        # When compositing, this is the band of fire that was uploaded instead of a bitmap.
+        self.bitmap = None
+
+        # The shared memory ring that frames are published to for other processes, if any.
+        self.ring = None
+
+        # The way frames are sent to OpenGL: glDrawPixels (pixels), streamed through pixel
+        # buffer objects into a texture (pbo), or composited from layers on the GPU (composite).
+        # The streamer or compositor is created once the window exists.
+        self.backend = backend
+        self.streamer = None
+        self.compositor = None
+
+        # The recorder while the session is being recorded and the recording (with the position
+        # in it) while one is being played back instead of the fire.
+        self.recorder = None
+        self.replay = None
+
+    def create_buffers(self):
+        """
+            This method creates the back buffer, the engine, and the emitters for the current
+            geometry.  The back buffer only has the palette lookup value, so it is only a 1/4 of
+            the size.
+        """
+
+        geometry = self.geometry
+
+        if self.threaded is not None:
+            self.threaded.close()
+
+        self.back_buf = [0x00] * geometry.size
+        self.stdlib = self.threaded = None
+
+        if self.engine == 'stdlib':
+            self.stdlib = StdlibEngine(geometry)
+            self.back_buf = bytearray(geometry.size)
+        elif self.engine == 'threads':
+            # NumPy is only required for this engine.
+            from threaded_engine import ThreadedEngine
+
+            self.threaded = ThreadedEngine(geometry, self.threads)
+            self.back_buf = bytearray(geometry.size)
+
+        if np is not None:
+            from emitters import Emitters
+
+            self.emitters = Emitters(geometry)
+
+    def set_geometry(self, geometry):
+        """
+            This method switches to a new geometry.  The fire starts over at the new size.  The
+            size can't change while recording, publishing to a ring, or playing back since those
+            are fixed to one size.
+        """
+
+        if self.recorder is not None or self.ring is not None or self.replay is not None:
+            print('The size can not be changed while recording, publishing, or playing back')
+
+            return
+
+        self.geometry = geometry
+        self.create_buffers()
+
+        # Render the next frame whether or not a step is due.
+        self.bitmap = None
+
+        if self.handle is not None:
+            glut.glutReshapeWindow(geometry.w, geometry.h)
+            self.create_backend()
+
     def make_frame(self):
         """
-            This method creates the bitmap for the frame.  The algorithm is below:
+            This method advances the fire by one step and creates the bitmap for the frame.
+        """
+
+        self.step_fire()
+
+        return self.render_frame()
+
+    def step_fire(self):
+        """
+            This method advances the fire by one simulation step.  The algorithm is below:
 
             For the normal cases, average the value of the pixel directly below the
             current one, the pixel below and to the left, below and to the right, and
@@ -146,11 +300,34 @@ class Fire:
             This is a slight departure from the method used in the original GoldFire.
         """
 
+        if self.replay is not None:
+            # Show the next recorded frame instead.
+            self.replay_step()
+
+            return
+
+        if self.emitters is not None:
+            # Any heat above the first row of fire is advanced before the rows it reads change.
+            self.emitters.step_above(self.back_buf)
+
+        row_engine = self.stdlib or self.threaded
+
+        if row_engine is not None:
+            # Average whole rows at a time instead.  The pixels at either end of a row wrap
+            # around within the row.
+            row_engine.step(self.back_buf)
+            self.burn_word()
+            self.emit_heat()
+            self.advance_palette()
+
+            return
+
         # Make local copies to avoid the overhead of lookups.
-        cached, back_buf, window_w = self.cached, self.back_buf, self.window['w']
+        cached, back_buf, geometry = self.cached, self.back_buf, self.geometry
+        window_w = geometry.w
 
         # Precalculate values.
-        win_w_min, from_index = window_w - 1, self.window['first_row'] * window_w
+        win_w_min, from_index = window_w - 1, geometry.start_from
         to_index = from_index - window_w
 
         # Generate two rows of random data.
@@ -158,7 +335,7 @@ class Fire:
 
         # The fire cuts out on its own due to the algorithm.  Only the bottom 50 or so
         # rows need to be calculated.
-        for _ in range(self.window['first_row'], self.window['h'] - 2):
+        for _ in range(geometry.first_row, geometry.h - 2):
             # The last two rows are calculated separately since they
             # have special processing due to the random data.
 
@@ -191,7 +368,7 @@ class Fire:
                     cached[back_buf[from_window - 1]][back_buf[from_window + win_w_min]]
 
         # The next row is pre-calculated to save processing.
-        col_index = from_index = (self.window['h'] - 1) * window_w
+        col_index = from_index = geometry.end_from - window_w
         to_index = from_index - window_w
 
         for col in range(1, win_w_min):
@@ -228,82 +405,169 @@ class Fire:
             cached[random_bytes[window_w - 2]][random_bytes[window_w]] + \
                 cached[random_bytes[win_w_min]][random_bytes[(window_w + window_w) - 1]]
 
-        # Make local copies to avoid the overhead of lookups.
-        cur_fire_palette, black_pixels \
-            = self.current_fire_palette, self.black_pixels[self.palette_flags['index']]
+        # Update the instance's back buffer and move any palette transition along.
+        self.back_buf = back_buf
 
-        start_from, end_from, first_row \
-            = self.start_from, \
-            self.end_from, \
-            (self.window['h'] - self.window['first_row']) * window_w
+        self.burn_word()
+        self.emit_heat()
+        self.advance_palette()
 
-        logo = self.logo['logo']
+    def replay_step(self):
+        """
+            This method copies the next frame of the recording into the back buffer and
+            switches to its palettes if they changed.  The recording starts over at the end.
+        """
 
-        if self.display_word:
-            # The user chose to display a word in the fire, process it.
-            start_col = self.logo['start_col']
-            end_col = start_col + self.logo['logo_cols']
+        replay, geometry = self.replay, self.geometry
+        frame = replay['recording'].frame(replay['pos'])
+        replay['pos'] = (replay['pos'] + 1) % len(replay['recording'])
 
-            pal_index = 0
+        # The band starts above the first row of fire if the emitters had heated those rows.
+        start = geometry.end_from - len(frame['band'])
 
-            for index in range(self.logo['fire_start'], self.logo['fire_end']):
-                calc_index = (index * window_w)
+        if self.emitters is not None:
+            # Cool the rows that were heated in the last frame but not in this one and draw
+            # the rows that are.
+            top = min(self.emitters.active_row, geometry.first_row) * geometry.w
 
-                # Copy an entire row of the logo at a time.
-                back_buf[calc_index + start_col:calc_index + end_col] \
-                    = logo[pal_index:pal_index + end_col - start_col]
+            if top < start:
+                self.back_buf[top:start] = bytes(start - top)
 
-                pal_index += end_col - start_col
+            self.emitters.active_row = start // geometry.w
 
-            self.display_word = False
+        self.back_buf[start:geometry.end_from] = frame['band']
 
-        # Update the instance's back buffer and clear the display buffer by setting it to black.
-        self.back_buf, display_buf = back_buf, bytearray(self.window['size'] * 3)
+        if frame['fire_palette'] != self.current_fire_palette or \
+                frame['words_palette'] != self.current_words_palette:
+            # The recorded palettes already include any crossfade or cycling.
+            self.current_fire_palette = frame['fire_palette']
+            self.current_words_palette = frame['words_palette']
+            self.current_black = find_black_pixels(frame['fire_palette'])
+            self.sequence = None
+            self.frame_state.palette_changed = True
 
-        # Calculate the start and end columns of the logo.
-        start_col = self.logo['start_col'] * 3
-        end_col = start_col + self.logo['logo_cols'] * 3
+    def start_replay(self, path, position=0):
+        """ This method plays back a recording instead of running the fire. """
 
-        if self.palette_flags['changed']:
-            # The palette changed, update the text area.
-            cur_words_palette = self.current_words_palette
+        recording = Recording(path)
+        meta = recording.meta
 
-            self.words_buf = bytearray(len(logo) * 3)
+        if (meta['w'], meta['h'], meta['first_row']) \
+                != (self.geometry.w, self.geometry.h, self.geometry.first_row):
+            recording.close()
 
-            pal_index = words_index = 0
+            raise ValueError(f'{path} was recorded at a different size')
 
-            for index in range(self.logo['start_row'], self.logo['end_row']):
-                calc_index = (index * window_w * 3)
+        if len(recording) == 0:
+            # Recording was stopped before a frame was written (or the writer failed first).
+            recording.close()
 
-                for col in range(start_col, end_col, 3):
-                    # Do not process black pixels as they won't be seen.
-                    if logo[pal_index] not in black_pixels:
-                        # Precalculate values used more than once.
-                        calc_col, calc_pal = calc_index + col, logo[pal_index] * 3
+            raise ValueError(f'{path} has no frames to play back')
 
-                        # Update the display buffer and the words cache.
-                        display_buf[calc_col:calc_col + 3] \
-                            = self.words_buf[words_index:words_index + 3] \
-                            = cur_words_palette[calc_pal:calc_pal + 3]
+        self.replay = {'recording': recording, 'pos': position % len(recording)}
 
-                    words_index += 3
-                    pal_index += 1
+    def toggle_recording(self):
+        """
+            This method starts recording to a new folder under recordings or stops the current
+            recording.  Stopping does not wait for the writer to finish.
+        """
 
-            self.palette_flags['changed'] = False
+        if self.recorder is None:
+            path = os.path.join('recordings', strftime('goldfire_%Y%m%d_%H%M%S'))
+            self.recorder = Recorder(path, self.geometry.w, self.geometry.h,
+                                     self.geometry.first_row)
+
+            print(f'Recording to {path}')
         else:
-            # The palette did not change so use the cached logo.
+            self.recorder.close(wait=False)
+            self.print_recording_stats()
+            self.recorder = None
+
+    def print_recording_stats(self):
+        """ This method displays how the recording went and what it cost the display. """
+
+        stats = self.recorder.stats
+
+        print(f'Frames recorded: {stats["frames"] - stats["dropped"]}')
+        print(f'Frames dropped: {stats["dropped"]}')
+
+        if stats['error'] is not None:
+            print(f'Recording failed: {stats["error"]!r}')
+
+        if stats['frames']:
+            print(f'Recording time / frame: {stats["record_time"] * 1e6 / stats["frames"]:.1f} us')
+
+    def burn_word(self):
+        """
+            This method copies the logo into the fire if the user asked for it, where it
+            will flame out.
+        """
+
+        if not self.display_word:
+            return
+
+        # Make local copies to avoid the overhead of lookups.
+        back_buf, geometry, logo = self.back_buf, self.geometry, self.logo
+        window_w = geometry.w
+
+        start_col = geometry.logo_start_col
+        end_col = start_col + geometry.logo_cols
+
+        pal_index = 0
 
-            buf_start = self.logo['start_row'] * window_w * 3 + start_col
-            words_start = 0
-            logo_cols = self.logo['logo_cols'] * 3
+        for index in range(geometry.fire_start, geometry.fire_end):
+            calc_index = (index * window_w)
 
-            for index in range(0, 20):
-                # Copy each row of the logo to the display buffer.
-                display_buf[buf_start:buf_start + logo_cols] \
-                    = self.words_buf[words_start:words_start + logo_cols]
+            # Copy an entire row of the logo at a time.
+            back_buf[calc_index + start_col:calc_index + end_col] \
+                = logo[pal_index:pal_index + end_col - start_col]
 
-                buf_start += self.window['w'] * 3
-                words_start += logo_cols
+            pal_index += end_col - start_col
+
+        self.display_word = False
+
+    def emit_heat(self):
+        """ This method adds the heat from the emitters, all of them at once. """
+
+        if self.emitters is not None:
+            self.emitters.apply(self.back_buf)
+
+    def render_frame(self):
+        """
+            This method creates the bitmap for the frame from the current state of the back
+            buffer.  It does not advance the fire.
+        """
+
+        # Make local copies to avoid the overhead of lookups.
+        back_buf, geometry = self.back_buf, self.geometry
+
+        cur_fire_palette, black_pixels, words_buf = self.frame_palettes()
+
+        start_from, end_from, first_row \
+            = geometry.start_from, geometry.end_from, geometry.mirror_from
+
+        # Clear the display buffer by setting it to black.
+        display_buf = bytearray(geometry.size * 3)
+
+        if self.threaded is not None:
+            # The threads build the words and the fire a band each.
+            self.threaded.render(display_buf, back_buf, cur_fire_palette, words_buf)
+
+            return self.render_above(display_buf, cur_fire_palette)
+
+        # Copy each row of the logo to the display buffer.  The offsets of the rows are
+        # calculated with the geometry.
+        logo_cols = geometry.logo_bytes
+
+        for buf_start, words_start in geometry.logo_rows:
+            display_buf[buf_start:buf_start + logo_cols] \
+                = words_buf[words_start:words_start + logo_cols]
+
+        if self.stdlib is not None:
+            # Color the whole band a plane at a time instead.
+            self.stdlib.colorize(display_buf, back_buf, cur_fire_palette)
+
+            return self.render_above(display_buf, cur_fire_palette)
 
         for index, value in enumerate(back_buf[start_from:end_from + 1]):
             # Update only the fire area.  Only perform half of the loops since the top
@@ -319,7 +583,90 @@ class Fire:
                     = display_buf[idx2:idx2 + 3] \
                     = cur_fire_palette[quad:quad + 3]
 
-        return display_buf
+        return self.render_above(display_buf, cur_fire_palette)
+
+    def top_row(self):
+        """
+            This method returns the top row with heat in it: the first row of fire unless the
+            emitters have heated the rows above.
+        """
+
+        if self.emitters is None:
+            return self.geometry.first_row
+
+        return min(self.emitters.active_row, self.geometry.first_row)
+
+    def render_above(self, display_buf, cur_fire_palette):
+        """
+            This method draws any heat from the emitters that is above the first row of fire
+            and returns the display buffer.
+        """
+
+        if self.emitters is None:
+            return display_buf
+
+        return self.emitters.render_above(display_buf, self.back_buf, cur_fire_palette)
+
+    def composite_frame(self):
+        """
+            This method sends the frame to the compositor instead of creating a bitmap.  Only
+            the palette indices of the bottom band of fire are uploaded; the compositor draws
+            them twice (once mirrored) and draws the words from a texture that is only uploaded
+            again when they change.  The band that was uploaded is returned.
+        """
+
+        cur_fire_palette, _, words_buf = self.frame_palettes()
+
+        # The palette and the words are only sent when they are different objects from the
+        # last frame, which only happens when the palette changes.
+        self.compositor.set_palette(cur_fire_palette)
+        self.compositor.set_logo(words_buf)
+
+        geometry = self.geometry
+        band = bytes(self.back_buf[geometry.start_from:geometry.end_from])
+        self.compositor.upload_fire(band)
+
+        # Any heat from the emitters above the band.
+        self.compositor.upload_above(
+            bytes(self.back_buf[self.top_row() * geometry.w:geometry.start_from]))
+
+        return band
+
+    def frame_palettes(self):
+        """
+            This method returns the fire palette, the black pixels of the fire palette, and the
+            colored words for the next frame.  The words are rebuilt if the palette changed.
+        """
+
+        if self.sequence:
+            # A palette transition is in progress, use the pre-calculated palettes and words.
+            # These do not need to be rebuilt.
+            seq, pos = self.sequence, self.sequence['pos']
+            self.frame_state.palette_changed = False
+
+            if seq['words'][pos] is None:
+                # The first time this step is shown, build its words and black pixels.
+                seq['black'][pos] = find_black_pixels(seq['fire'][pos])
+                seq['words'][pos] = colorize(self.logo, seq['words_palettes'][pos])
+
+            return seq['fire'][pos], seq['black'][pos], seq['words'][pos]
+
+        black_pixels = self.current_black
+
+        if self.frame_state.palette_changed:
+            # The palette changed, update the text area.
+            self.words_buf = self.build_words()
+            self.frame_state.palette_changed = False
+
+        return self.current_fire_palette, black_pixels, self.words_buf
+
+    def build_words(self):
+        """
+            This method colors the logo with the current word palette.  Black pixels come out
+            black since their palette entries are all zeros.
+        """
+
+        return colorize(self.logo, self.current_words_palette)
 
     def display_frame(self):
         """
@@ -327,102 +674,356 @@ class Fire:
             an updated frame of the fire.
         """
 
-        # Generate the new frame.
-        bitmap = self.make_frame()
+        # Apply the keys pressed since the last frame.
+        self.apply_keys()
+
+        # Advance the fire by however many steps are due since the last frame.
+        steps = self.advance_clock(perf_counter())
+
+        for _ in range(steps):
+            self.step_fire()
+
+        rendered = steps or self.bitmap is None or self.frame_state.palette_changed
+
+        if rendered:
+            # Generate the new frame.
+            if self.compositor is not None:
+                self.bitmap = self.composite_frame()
+            else:
+                self.bitmap = self.render_frame()
+
+            self.frame_state.renders += 1
+
+            if self.recorder is not None:
+                # The recorder copies the compact form of the frame out of the back buffer.
+                fire_palette, words_palette = self.displayed_palettes()
+
+                if not self.recorder.record(self.back_buf, fire_palette, words_palette,
+                                            self.top_row()) \
+                        and self.recorder.stats['error'] is not None:
+                    # The writer failed, so stop recording instead of dropping every frame.
+                    self.toggle_recording()
+
+            if self.ring is not None:
+                # Publish the new frame to other processes.
+                self.ring.write(self.back_buf, self.displayed_palettes()[0],
+                                None if self.compositor is not None else self.bitmap)
+
+            if self.streamer is not None:
+                # Start sending the new frame to the texture.
+                self.streamer.upload(self.bitmap)
+        elif not self.frame_state.damaged:
+            # Nothing changed since the last frame and the window still shows it, so keep it
+            # and wait for the next step instead of drawing the same frame again.
+            self.frame_state.reused += 1
+            self.wait_for_step()
+
+            return
 
         # Display the new frame.
-        gl.glDrawPixels(self.window['w'], self.window['h'], gl.GL_RGB, gl.GL_UNSIGNED_BYTE, bitmap)
+        if self.compositor is not None:
+            self.compositor.draw()
+        elif self.streamer is not None:
+            self.streamer.draw()
+        else:
+            gl.glDrawPixels(self.geometry.w, self.geometry.h, gl.GL_RGB, gl.GL_UNSIGNED_BYTE,
+                            self.bitmap)
+
         glut.glutSwapBuffers()
+        self.frame_state.damaged = False
+
+        if rendered and self.keys['waiting']:
+            # This is the first frame that shows the effect of the waiting key presses.
+            self.trace_keys(perf_counter())
 
         # Increment the number of frames for the purpose of calculating the FPS.
-        self.fps['frames'] += 1
+        self.frame_state.frames += 1
+
+    def expose_frame(self):
+        """
+            This method is the display callback for the OpenGL window.  GLUT calls it when the
+            window has to be repainted (when it is shown, uncovered, or resized), so the last
+            frame is drawn again even if nothing changed.
+        """
+
+        self.frame_state.damaged = True
+        self.display_frame()
+
+    def wait_for_step(self):
+        """
+            This method stops the idle callback until the next simulation step is due.  A GLUT
+            timer starts it again, so key presses and repaints are still handled while waiting.
+        """
+
+        timing = self.frame_state
+
+        if not timing.step or timing.waiting:
+            return
+
+        # The timer counts in whole milliseconds, so round up rather than wake up early.
+        delay = math.ceil((timing.step - timing.lag - (perf_counter() - timing.last_time)) * 1000)
+
+        if delay > 0:
+            timing.waiting = True
+            glut.glutIdleFunc(None)
+            glut.glutTimerFunc(delay, self.resume_frames, 0)
+
+    def resume_frames(self, _value=0):
+        """
+            This method starts the idle callback again after waiting for a step.  It is the
+            callback for the timer and is also called when a key is pressed.
+        """
+
+        if self.frame_state.waiting:
+            self.frame_state.waiting = False
+            glut.glutIdleFunc(self.display_frame)
+
+    def trace_keys(self, presented):
+        """ This method records the latency of the key presses that were just presented. """
+
+        keys = self.keys
+
+        keys['latency'].extend(presented - pressed for pressed in keys['waiting'])
+        keys['waiting'] = []
+
+    def print_key_stats(self):
+        """ This method displays how many key presses there were and how long they took. """
+
+        keys = self.keys
+        ordered = sorted(keys['latency'])
+
+        print(f'Key presses: {keys["events"]}')
+        print(f'Palette changes: {keys["changes"]}')
+
+        if ordered:
+            print(f'Key latency ms: p50 {percentile(ordered, 0.50) * 1000:.1f} '
+                  f'p95 {percentile(ordered, 0.95) * 1000:.1f} '
+                  f'p99 {percentile(ordered, 0.99) * 1000:.1f} '
+                  f'max {ordered[-1] * 1000:.1f}')
+
+    def advance_clock(self, now):
+        """
+            This method accumulates the time since the last call and returns the number of
+            simulation steps that are due.  The remainder is kept as lag for the next call.  If
+            the display falls too far behind, the extra steps are dropped (and counted) rather
+            than trying to catch up all at once.
+        """
+
+        timing = self.frame_state
+
+        if not timing.step:
+            # The simulation is not decoupled, advance once per frame.
+            timing.steps += 1
+
+            return 1
+
+        if timing.last_time is None:
+            timing.last_time = now
+
+        timing.lag += now - timing.last_time
+        timing.last_time = now
+
+        steps = int(timing.lag // timing.step)
+        timing.lag -= steps * timing.step
+
+        if steps > timing.max_steps:
+            # Too far behind, drop the steps that can't be caught up.
+            timing.dropped += steps - timing.max_steps
+            steps = timing.max_steps
+
+        timing.steps += steps
+
+        return steps
 
     def set_palettes(self):
         """
             This method is sets up the current palettes based on the greyscale flags.
         """
 
-        if self.palette_flags['grey']:
-            # Set both palettes to grey.
-            self.current_words_palette = self.greys[self.palette_flags['index']].copy()
-            self.current_fire_palette = self.greys[self.palette_flags['index']].copy()
-        elif self.palette_flags['words_grey']:
-            # Set the word palette to grey and the fire palette to color.
-            self.current_words_palette = self.greys[self.palette_flags['index']].copy()
-            self.current_fire_palette = self.palettes[self.palette_flags['index']].copy()
-        elif self.palette_flags['fire_grey']:
-            # Set the fire palette to grey and the word palette to color.
-            self.current_words_palette = self.palettes[self.palette_flags['index']].copy()
-            self.current_fire_palette = self.greys[self.palette_flags['index']].copy()
+        index = self.palette_flags['index']
+
+        # Grey palettes are black in the same places as the color ones.
+        self.current_black = self.black_pixels[index]
+
+        if self.palette_flags['grey'] or self.palette_flags['words_grey']:
+            # Set the word palette to grey.
+            self.current_words_palette = self.greys[index].copy()
+        else:
+            # Set the word palette to color.
+            self.current_words_palette = self.palettes[index].copy()
+
+        if self.palette_flags['grey'] or self.palette_flags['fire_grey']:
+            # Set the fire palette to grey.
+            self.current_fire_palette = self.greys[index].copy()
         else:
-            # Set both palettes to color.
-            self.current_words_palette = self.palettes[self.palette_flags['index']].copy()
-            self.current_fire_palette = self.palettes[self.palette_flags['index']].copy()
+            # Set the fire palette to color.
+            self.current_fire_palette = self.palettes[index].copy()
 
-    def pre_process_logo(self):
+    def change_palettes(self):
         """
-            This method creates the logo structure avoiding the need to recalculate the values
-            each time through the main loop.
+            This method switches to the palettes selected by the flags.  If fading is enabled,
+            the switch is a crossfade from the palettes currently on the screen, otherwise it is
+            a hard cut.
         """
 
-        logo = {
-            'logo': None,
-            'start_row': 0,
-            'end_row': 0,
-            'start_col': 0,
-            'fire_start': 0,
-            'fire_end': 0
-        }
+        fire_from, words_from = self.displayed_palettes()
+
+        self.set_palettes()
+
+        if self.palette_flags['fade_steps']:
+            # Pre-calculate the whole crossfade.
+            self.sequence = make_sequence(
+                make_blend_table(fire_from, self.current_fire_palette,
+                                 self.palette_flags['fade_steps']),
+                make_blend_table(words_from, self.current_words_palette,
+                                 self.palette_flags['fade_steps']))
+        elif self.palette_flags['cycle']:
+            self.start_cycle()
+        else:
+            self.sequence = None
+            self.frame_state.palette_changed = True
+
+    def displayed_palettes(self):
+        """
+            This method returns the fire and word palettes that are currently on the screen,
+            which may be part way through a transition.
+        """
+
+        if self.sequence:
+            pos = self.sequence['pos']
+
+            return self.sequence['fire'][pos], self.sequence['words_palettes'][pos]
 
-        # Read the logo from the file.
-        logo['logo'] = read_logo()
+        return self.current_fire_palette, self.current_words_palette
 
-        # There are 20 rows so divide the total bytes by 20 to get the number of columns.  The
-        # divisor could be stored in a variable instead of being hard-coded, but that seemed
-        # unnecessary unless scaling is allowed at some point in the future.
-        logo_cols = len(logo['logo']) // 20
+    def start_cycle(self):
+        """ This method starts rotating the current palettes. """
 
-        # Set the first column such that the text will be centered.
-        logo['start_col'] = (self.window['w'] - logo_cols) // 2
+        self.sequence = make_sequence(self.cycle_table(self.current_fire_palette),
+                                      self.cycle_table(self.current_words_palette),
+                                      loop=True)
 
-        start_row = self.window['h'] - self.window['first_row']
-        end_row = self.window['first_row']
-        diff = (end_row - start_row)
+    def cycle_table(self, palette):
+        """ This method returns every rotation of a palette, calculating them only once. """
 
-        diff = ((diff - 20) >> 1)
-        start_row += diff
-        end_row = start_row + 20
+        key = bytes(palette)
 
-        logo['logo_cols'] = logo_cols
-        logo['start_row'] = start_row
-        logo['end_row'] = end_row
-        logo['fire_start'] = start_row + 87
-        logo['fire_end'] = end_row + 87
+        if key not in self.cycles:
+            self.cycles[key] = make_cycle_table(key)
 
-        return logo
+        return self.cycles[key]
+
+    def advance_palette(self):
+        """
+            This method moves any palette transition along by one step.  When a crossfade
+            finishes, the last pre-calculated words are kept so they do not need to be rebuilt.
+        """
+
+        seq = self.sequence
+
+        if seq is None:
+            return
+
+        seq['pos'] += 1
+
+        if seq['pos'] == len(seq['fire']):
+            if seq['loop']:
+                # Cycling wraps around to the start.
+                seq['pos'] = 0
+            else:
+                # The crossfade is done, the current palettes are now on the screen.  Keep the
+                # words for the last step if it was shown, otherwise build them.
+                self.sequence = None
+
+                if seq['words'][-1] is None:
+                    self.frame_state.palette_changed = True
+                else:
+                    self.words_buf = bytearray(seq['words'][-1])
+
+                if self.palette_flags['cycle']:
+                    self.start_cycle()
 
     def kb_input(self, key, _x_pos, _y_pos):
-        """ This method handles keyboard input from the user. """
+        """
+            This method handles keyboard input from the user.  Quitting happens right away,
+            every other key is queued with the time it was pressed until the next frame.
+        """
 
         if key in [b'q', b'Q', b'\x1B']:
             # If the user pressed q or esc, terminate the program.
 
             # Get the current time and caculate the elapsed time and FPS.
-            stop_time = perf_counter()
-            elapsed_time = stop_time - self.fps['start_time']
-            fps = self.fps['frames'] / elapsed_time
+            stop_time, timing = perf_counter(), self.frame_state
+            elapsed_time = stop_time - timing.start_time
+            fps = timing.frames / elapsed_time
 
             # Close the OpenGL window.
-            glut.glutDestroyWindow(self.window['handle'])
+            glut.glutDestroyWindow(self.handle)
+
+            if self.ring is not None:
+                # Stop publishing frames.
+                self.ring.close()
+
+            if self.recorder is not None:
+                # Finish writing the recording.
+                self.recorder.close()
+                self.print_recording_stats()
+
+            if self.threaded is not None:
+                # Stop the worker threads.
+                self.threaded.close()
 
             # Display the statistics to the user.
-            print(f'Frames: {self.fps["frames"]}')
+            print(f'Frames: {timing.frames}')
             print(f'Seconds: {elapsed_time}')
             print(f'FPS: {fps}')
-        elif key in [b'p', b'P']:
-            # If the user pressed p, cycle through the palettes.
-            self.palette_flags['changed'] = True
+            print(f'Simulation steps: {timing.steps}')
+            print(f'Steps / second: {timing.steps / elapsed_time}')
+            print(f'Frames rendered: {timing.renders}')
+            print(f'Frames kept (no step due): {timing.reused}')
+            print(f'Steps dropped: {timing.dropped}')
+            print(f'Lag: {timing.lag * 1000:.3f} ms')
+            self.print_key_stats()
+        else:
+            self.keys['queue'].append((key, perf_counter()))
+
+            # Apply the key on the next frame instead of after the next step.
+            self.resume_frames()
+
+    def apply_keys(self):
+        """
+            This method applies the queued key presses in the order they were pressed.  The
+            palettes are only changed once, after all of them, so only the final state is
+            built.
+        """
+
+        keys = self.keys
+
+        if not keys['queue']:
+            return
+
+        events, keys['queue'] = keys['queue'], []
 
+        for key, pressed in events:
+            self.apply_key(key)
+            keys['waiting'].append(pressed)
+
+        keys['events'] += len(events)
+
+        if keys['change']:
+            keys['change'] = False
+            keys['changes'] += 1
+
+            self.change_palettes()
+
+    def apply_key(self, key):
+        """
+            This method applies a single key press.  Keys that change the palettes only set
+            the flags and ask for the change, which apply_keys makes once.
+        """
+
+        if key in [b'p', b'P']:
+            # If the user pressed p, cycle through the palettes.
             if self.palette_flags['index'] == self.palette_flags['total'] - 1:
                 # If the last palette is already in use, go back to the default palette.
                 self.palette_flags['index'] = 0
@@ -430,47 +1031,106 @@ class Fire:
                 # Go to the next palette.
                 self.palette_flags['index'] += 1
 
-            self.set_palettes()
+            self.keys['change'] = True
         elif key in ([b'r', b'R']):
             # If the user pressed r, select a random palette.
             self.palette_flags['index'] = random.randint(0, self.palette_flags['total'] - 1)
-            self.palette_flags['changed'] = True
 
-            self.set_palettes()
+            self.keys['change'] = True
         elif key in ([b'g', b'G']):
             # If the user pressed g, change the palette to greyscale.
             self.palette_flags['grey'] = True
             self.palette_flags['fire_grey'] = True
             self.palette_flags['words_grey'] = True
-            self.palette_flags['changed'] = True
 
-            self.current_words_palette = self.greys[self.palette_flags['index']]
-            self.current_fire_palette = self.greys[self.palette_flags['index']]
+            self.keys['change'] = True
         elif key in ([b'c', b'C']):
             # If the user pressed c, change the palette to color.
             self.palette_flags['grey'] = False
             self.palette_flags['fire_grey'] = False
             self.palette_flags['words_grey'] = False
-            self.palette_flags['changed'] = True
 
-            self.current_words_palette = self.palettes[self.palette_flags['index']]
-            self.current_fire_palette = self.palettes[self.palette_flags['index']]
+            self.keys['change'] = True
         elif key in ([b'f', b'F']):
             # If the user presses f, change the fire to greyscale.
             self.palette_flags['fire_grey'] = True
-            self.palette_flags['changed'] = True
 
-            self.current_fire_palette = self.greys[self.palette_flags['index']]
+            self.keys['change'] = True
         elif key in ([b'w', b'W']):
             # If the user presses w, change the fire to greyscale.
             self.palette_flags['words_grey'] = True
-            self.palette_flags['changed'] = True
 
-            self.current_words_palette = self.greys[self.palette_flags['index']]
+            self.keys['change'] = True
         elif key in ([b'a', b'A']):
             # If the user presses a, display "GoldFire" in the fire area and process it.  This is
             # command a becuase, in the original version, it displayed "ABRAXAS".
             self.display_word = True
+        elif key in ([b'y', b'Y']):
+            # If the user presses y, start or stop cycling the palettes.
+            self.palette_flags['cycle'] = not self.palette_flags['cycle']
+
+            if self.palette_flags['cycle'] and self.sequence is None \
+                    and not self.keys['change']:
+                # Start cycling right away unless a crossfade is running or about to start.
+                # If one is, the cycle will start when it finishes.
+                self.start_cycle()
+            elif not self.palette_flags['cycle'] and self.sequence and self.sequence['loop']:
+                # Return to the un-rotated palettes.
+                self.keys['change'] = True
+        elif key in ([b'v', b'V']):
+            # If the user presses v, start or stop recording.
+            self.toggle_recording()
+        elif key in ([b'e', b'E']) and self.emitters is not None:
+            # If the user presses e, put out all of the emitters.
+            self.emitters.clear()
+        elif key in ([b'h', b'H']):
+            # If the user presses h, switch between the 320x200 and 384x240 screen modes.
+            if (self.geometry.w, self.geometry.h) == (320, 200):
+                self.set_geometry(self.geometry.resized(384, 240))
+            else:
+                self.set_geometry(self.geometry.resized(320, 200))
+
+    def mouse_input(self, button, state, x_pos, y_pos):
+        """
+            This method handles the mouse buttons.  The left button starts (or ends) a stroke
+            and the right button places a steady emitter.
+        """
+
+        x_pos, y_pos = self.window_point(x_pos, y_pos)
+        brush = self.brush
+
+        if button == glut.GLUT_LEFT_BUTTON:
+            if state == glut.GLUT_DOWN:
+                self.emitters.add_points(x_pos, y_pos, brush['intensity'], brush['decay'],
+                                         brush['radius'])
+                brush['last'] = (x_pos, y_pos)
+            else:
+                brush['last'] = None
+        elif button == glut.GLUT_RIGHT_BUTTON and state == glut.GLUT_DOWN:
+            self.emitters.add_points(x_pos, y_pos, brush['intensity'], 1.0, brush['radius'])
+
+    def mouse_motion(self, x_pos, y_pos):
+        """ This method continues a stroke while the left button is held down. """
+
+        brush = self.brush
+
+        if brush['last'] is None:
+            return
+
+        x_pos, y_pos = self.window_point(x_pos, y_pos)
+
+        self.emitters.add_line(brush['last'], (x_pos, y_pos), brush['intensity'],
+                               brush['decay'], brush['radius'])
+        brush['last'] = (x_pos, y_pos)
+
+    def window_point(self, x_pos, y_pos):
+        """
+            This method converts a mouse position to a pixel in the frame in case the window was
+            resized.  The top row of the frame is at the top of the window.
+        """
+
+        return x_pos * self.geometry.w // max(glut.glutGet(glut.GLUT_WINDOW_WIDTH), 1), \
+            y_pos * self.geometry.h // max(glut.glutGet(glut.GLUT_WINDOW_HEIGHT), 1)
 
     def main(self):
         """
@@ -485,31 +1145,59 @@ class Fire:
         # Get the width and height of the monitor and the center for the window.
         screen_w = glut.glutGet(glut.GLUT_SCREEN_WIDTH)
         screen_h = glut.glutGet(glut.GLUT_SCREEN_HEIGHT)
-        center_x = int((screen_w - self.window['w']) >> 1)
-        center_y = int((screen_h - self.window['h']) >> 1)
+        center_x = int((screen_w - self.geometry.w) >> 1)
+        center_y = int((screen_h - self.geometry.h) >> 1)
 
         # Create the OpenGL window and display it.
         glut.glutInitDisplayMode(glut.GLUT_RGB)
-        glut.glutInitWindowSize(self.window['w'], self.window['h'])
+        glut.glutInitWindowSize(self.geometry.w, self.geometry.h)
         glut.glutInitWindowPosition(center_x, center_y)
-        self.window['handle'] = glut.glutCreateWindow('GoldFire Rides Again'.encode('ascii'))
+        self.handle = glut.glutCreateWindow('GoldFire Rides Again'.encode('ascii'))
 
         # Setup the callbacks for OpenGL.
-        glut.glutDisplayFunc(self.display_frame)
+        glut.glutDisplayFunc(self.expose_frame)
         glut.glutIdleFunc(self.display_frame)
         glut.glutKeyboardFunc(self.kb_input)
 
+        if self.emitters is not None:
+            glut.glutMouseFunc(self.mouse_input)
+            glut.glutMotionFunc(self.mouse_motion)
+
         # Flip the image upside-right.
         gl.glLoadIdentity()
         gl.glRasterPos2f(-1, 1)
         gl.glPixelZoom(1, -1)
 
-        # Initialize the timer for calculating the FPS.
-        self.fps['start_time'] = perf_counter()
+        self.create_backend()
+
+        # Initialize the timer for calculating the FPS and the simulation clock.
+        self.frame_state.start_time = self.frame_state.last_time = perf_counter()
 
         # Start the main program loop.
         glut.glutMainLoop()
 
+    def create_backend(self):
+        """
+            This method creates the streamer or compositor for the backend at the size of the
+            geometry, replacing any that already exist.
+        """
+
+        geometry = self.geometry
+
+        for existing in (self.streamer, self.compositor):
+            if existing is not None:
+                existing.delete()
+
+        self.streamer = self.compositor = None
+
+        if self.backend == 'pbo':
+            # Stream the frames through pixel buffer objects instead of using glDrawPixels.
+            self.streamer = TextureStreamer(geometry.w, geometry.h)
+        elif self.backend == 'composite':
+            # Only upload the bottom band of fire and let OpenGL mirror it and add the words.
+            self.compositor = LayerCompositor(geometry.w, geometry.h, geometry.first_row,
+                                              geometry.logo_rect)
+
 def read_palettes():
     """
         This function reads the palettes from the palettes folder on disk.  Users can supply
@@ -528,7 +1216,7 @@ def read_palettes():
     black_pixels.append([])
 
     # Find all of the palette files in the palettes folder.
-    files = glob.glob(r'palettes\*.bin')
+    files = glob.glob(os.path.join('palettes', '*.bin'))
 
     for file in files:
         if os.path.getsize(file) != 768:
@@ -600,6 +1288,62 @@ def make_palette(file):
 
     return palette, greys, black_pixels
 
+def make_blend_table(from_palette, to_palette, steps):
+    """
+        This function calculates all of the steps of a crossfade between two palettes at once.
+        The result is a list of steps palettes of 256 red, green, and blue triplets.  The last
+        step is the destination palette.
+    """
+
+    if np is None:
+        return [bytes(round(start + (end - start) * step / steps)
+                      for start, end in zip(from_palette, to_palette))
+                for step in range(1, steps + 1)]
+
+    # The same sums for every step and channel at once.  np.rint rounds halves to even, the
+    # same as round.
+    start = np.frombuffer(bytes(from_palette), dtype=np.uint8).astype(np.float64)
+    change = np.frombuffer(bytes(to_palette), dtype=np.uint8) - start
+
+    table = np.rint(start + change * np.arange(1, steps + 1)[:, None] / steps)
+
+    return [row.tobytes() for row in table.astype(np.uint8)]
+
+def make_cycle_table(palette):
+    """
+        This function calculates every rotation of a palette at once for palette cycling.  The
+        first entry is left alone so that the background stays black.
+    """
+
+    palette = bytes(palette)
+    first, rest = palette[:3], palette[3:]
+
+    return [first + rest[shift:] + rest[:shift] for shift in range(0, 255 * 3, 3)]
+
+def make_sequence(fire_table, words_table, loop=False):
+    """
+        This function turns a table of fire palettes and a table of word palettes into a palette
+        sequence.  The set of black pixels for each fire palette and the colored words for each
+        word palette are filled in by Fire.frame_palettes the first time each step is shown and
+        kept, so a cycle only builds them on its first time around.
+    """
+
+    return {
+        'fire': fire_table,
+        'words_palettes': words_table,
+        'words': [None] * len(words_table),
+        'black': [None] * len(fire_table),
+        'pos': 0,
+        'loop': loop
+    }
+
+def find_black_pixels(palette):
+    """ This function returns the set of palette indices that are black. """
+
+    return {index for index, (red, green, blue)
+            in enumerate(zip(palette[0::3], palette[1::3], palette[2::3]))
+            if not (red or green or blue)}
+
 def create_cache():
     """
         This function sets up a partial lookup table for the pixel calculations.
@@ -638,8 +1382,67 @@ def generate_data(window_w):
         of the palette. These are used in the averaging algorithm.
     """
 
+    if np is None:
+        return random.choices((0, 128), (43, 57), k=window_w + window_w)
+
     return np.random.choice([0, 128], size=window_w + window_w, p=[0.43, 0.57])
 
+def parse_args():
+    """ This function parses the command line arguments. """
+
+    parser = argparse.ArgumentParser(description='GoldFire Rides Again')
+    parser.add_argument('--sim-rate', type=float, default=70,
+                        help='simulation steps per second (0 ties the fire to the frame rate)')
+    parser.add_argument('--fade-steps', type=int, default=35,
+                        help='simulation steps in a palette crossfade (0 for a hard cut)')
+    parser.add_argument('--backend', choices=['pixels', 'pbo', 'composite'], default='pixels',
+                        help='send frames with glDrawPixels, stream them through pixel buffers, '
+                             'or composite the fire and words on the GPU')
+    parser.add_argument('--engine', choices=['python', 'stdlib', 'threads'], default='python',
+                        help='advance and color the fire a pixel at a time (python), a row '
+                             'at a time with the standard library (stdlib), or in bands on a '
+                             'pool of threads with NumPy (threads)')
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1,
+                        help='number of threads used by the threads engine')
+    parser.add_argument('--brush-intensity', type=int, default=128,
+                        help='palette index the mouse heats the fire to')
+    parser.add_argument('--brush-decay', type=float, default=0.85,
+                        help='fraction of the heat a stroke keeps after each step (1 to never '
+                             'fade)')
+    parser.add_argument('--size', choices=['320x200', '384x240'], default='320x200',
+                        help='screen mode to start in (H switches between them)')
+    parser.add_argument('--replay', metavar='PATH',
+                        help='play back a recording made with V instead of running the fire')
+    parser.add_argument('--replay-from', type=int, default=0, metavar='FRAME',
+                        help='position in the recording to start playing back from')
+    parser.add_argument('--ring', nargs='?', const=default_path(), default=None, metavar='PATH',
+                        help='publish frames to a shared memory ring for other processes')
+    parser.add_argument('--ring-slots', type=int, default=4,
+                        help='number of frames kept in the shared memory ring')
+    parser.add_argument('--ring-rgb', action='store_true',
+                        help='also publish the finished RGB frames to the ring (not with '
+                             '--backend composite)')
+
+    args = parser.parse_args()
+
+    if args.ring_rgb and args.backend == 'composite':
+        # The compositor builds the frame on the GPU, so there is no RGB frame to publish.
+        parser.error('--ring-rgb can not be used with --backend composite')
+
+    return args
+
 if __name__ == '__main__':
-    FIRE = Fire()
+    ARGS = parse_args()
+    FIRE = Fire(sim_rate=ARGS.sim_rate, fade_steps=ARGS.fade_steps, backend=ARGS.backend,
+                engine=ARGS.engine, threads=ARGS.threads,
+                brush_intensity=ARGS.brush_intensity, brush_decay=ARGS.brush_decay,
+                size=tuple(int(size) for size in ARGS.size.split('x')))
+
+    if ARGS.replay:
+        FIRE.start_replay(ARGS.replay, ARGS.replay_from)
+
+    if ARGS.ring:
+        FIRE.ring = FrameRingWriter(ARGS.ring, FIRE.geometry.w, FIRE.geometry.h,
+                                    ARGS.ring_slots, ARGS.ring_rgb)
+
     FIRE.main()
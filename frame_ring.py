@@ -0,0 +1,262 @@
+"""
+    This module shares the frames of the fire with other processes on the same machine through a
+    memory-mapped ring buffer.  The writer (GoldFire) stores each frame in the next slot of the
+    ring and the readers (compositors, recorders, overlays, etc.) map the same file and look at
+    the frames in place without copying them or going through a socket.
+
+    The layout of the file is a header followed by a number of slots:
+
+        header: magic, version, slots, width, height, rgb flag, slot size, latest frame number
+        slot:   sequence, frame number, index buffer (width * height), palette (768), rgb
+
+    The index buffer holds the palette index of every pixel of the fire and the palette holds 256
+    red, green, and blue triplets.  The rgb area is only present if the writer was asked to store
+    the finished frame as well.
+
+    There are no locks.  Each slot has a sequence counter that the writer makes odd before it
+    starts changing the slot and even again when it is done (a seqlock).  A reader checks the
+    counter before and after it looks at a slot and, if it changed or was odd, the frame was
+    overwritten while it was being read and is thrown away.  Since the writer never waits for the
+    readers, any number of readers can be attached without slowing down the display.
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+
+MAGIC = b'GFRING01'
+VERSION = 1
+
+# magic, version, slots, width, height, rgb flag, slot size, latest frame number
+HEADER = struct.Struct('<8sIIIIIQQ')
+HEADER_SIZE = 64
+LATEST_OFFSET = HEADER.size - 8
+
+# sequence, frame number
+SLOT_HEADER = struct.Struct('<QQ')
+SLOT_HEADER_SIZE = 16
+
+PALETTE_SIZE = 768
+
+# The writer has not stored a frame yet.
+NO_FRAME = 0xFFFFFFFFFFFFFFFF
+
+def default_path():
+    """
+        This function returns the default location of the ring buffer.  Shared memory is used if
+        it is available so the frames never touch the disk.
+    """
+
+    folder = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+    return os.path.join(folder, 'goldfire.ring')
+
+def slot_size(width, height, rgb):
+    """ This function calculates the size of one slot rounded up to a multiple of 64 bytes. """
+
+    size = SLOT_HEADER_SIZE + width * height + PALETTE_SIZE
+
+    if rgb:
+        size += width * height * 3
+
+    return (size + 63) & ~63
+
+class FrameRingWriter:
+    """
+        This class creates the ring buffer and writes frames to it.  There should only be one
+        writer for a ring.
+    """
+
+    def __init__(self, path, width, height, slots=4, rgb=False):
+        self.path = path
+        self.layout = {
+            'slots': slots,
+            'width': width,
+            'height': height,
+            'rgb': rgb,
+            'index_size': width * height,
+            'slot_size': slot_size(width, height, rgb)
+        }
+
+        size = HEADER_SIZE + slots * self.layout['slot_size']
+
+        with open(path, 'w+b') as ring_fh:
+            ring_fh.truncate(size)
+            self.ring = mmap.mmap(ring_fh.fileno(), size)
+
+        HEADER.pack_into(self.ring, 0, MAGIC, VERSION, slots, width, height, int(rgb),
+                         self.layout['slot_size'], NO_FRAME)
+
+        self.frame = 0
+
+    def write(self, index_buf, palette, rgb_buf=None):
+        """
+            This method stores a frame in the next slot.  The index buffer and palette can be
+            anything that bytes() accepts.  The rgb buffer is ignored unless the ring was
+            created with rgb enabled.
+        """
+
+        # Make local copies to avoid the overhead of lookups.
+        ring, layout, frame = self.ring, self.layout, self.frame
+
+        offset = HEADER_SIZE + (frame % layout['slots']) * layout['slot_size']
+        data = offset + SLOT_HEADER_SIZE
+        pal = data + layout['index_size']
+
+        # Mark the slot as being written.
+        SLOT_HEADER.pack_into(ring, offset, frame + frame + 1, frame)
+
+        ring[data:pal] = index_buf if isinstance(index_buf, (bytes, bytearray)) \
+            else bytes(index_buf)
+        ring[pal:pal + PALETTE_SIZE] = palette if isinstance(palette, (bytes, bytearray)) \
+            else bytes(palette)
+
+        if layout['rgb'] and rgb_buf is not None:
+            ring[pal + PALETTE_SIZE:pal + PALETTE_SIZE + layout['index_size'] * 3] = rgb_buf
+
+        # Mark the slot as complete and publish it.
+        SLOT_HEADER.pack_into(ring, offset, frame + frame + 2, frame)
+        struct.pack_into('<Q', ring, LATEST_OFFSET, frame)
+
+        self.frame = frame + 1
+
+    def close(self, remove=True):
+        """ This method closes the ring buffer and, by default, removes the file. """
+
+        self.ring.close()
+
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+
+class FrameRingReader:
+    """
+        This class maps a ring buffer created by FrameRingWriter and reads frames from it
+        without copying them.
+
+        The views returned by latest() point directly into the ring, so the writer can overwrite
+        them at any time.  Once a reader is done with a frame it must call is_current() with the
+        frame number and throw away anything it calculated if that returns False.  read() does
+        this automatically and returns copies instead.
+    """
+
+    def __init__(self, path=None):
+        path = path or default_path()
+
+        with open(path, 'rb') as ring_fh:
+            self.ring = mmap.mmap(ring_fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, slots, width, height, rgb, size, _ \
+            = HEADER.unpack_from(self.ring, 0)
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a GoldFire frame ring')
+
+        self.layout = {
+            'slots': slots,
+            'width': width,
+            'height': height,
+            'rgb': bool(rgb),
+            'index_size': width * height,
+            'slot_size': size
+        }
+
+        self.view = memoryview(self.ring)
+
+        # The number of frames thrown away because they were overwritten while being read.
+        self.retries = 0
+
+    def latest_frame(self):
+        """ This method returns the number of the newest frame or None if there isn't one. """
+
+        frame = struct.unpack_from('<Q', self.ring, LATEST_OFFSET)[0]
+
+        return None if frame == NO_FRAME else frame
+
+    def slot_offset(self, frame):
+        """ This method returns the offset of the slot that holds a frame. """
+
+        return HEADER_SIZE + (frame % self.layout['slots']) * self.layout['slot_size']
+
+    def latest(self):
+        """
+            This method returns the newest complete frame as a dict of the frame number and
+            memoryviews of the index buffer, palette and, if present, rgb buffer.  None is
+            returned if there are no frames yet.
+        """
+
+        while True:
+            frame = self.latest_frame()
+
+            if frame is None:
+                return None
+
+            offset = self.slot_offset(frame)
+            sequence, slot_frame = SLOT_HEADER.unpack_from(self.ring, offset)
+
+            if sequence == frame + frame + 2 and slot_frame == frame:
+                break
+
+            # The slot is being written, try again with the newest frame.
+            self.retries += 1
+
+        data = offset + SLOT_HEADER_SIZE
+        pal = data + self.layout['index_size']
+        rgb = pal + PALETTE_SIZE
+
+        return {
+            'frame': frame,
+            'index': self.view[data:pal],
+            'palette': self.view[pal:rgb],
+            'rgb': self.view[rgb:rgb + self.layout['index_size'] * 3]
+                   if self.layout['rgb'] else None
+        }
+
+    def is_current(self, frame):
+        """
+            This method checks that a frame returned by latest() has not been overwritten since.
+        """
+
+        sequence, slot_frame = SLOT_HEADER.unpack_from(self.ring, self.slot_offset(frame))
+
+        return sequence == frame + frame + 2 and slot_frame == frame
+
+    def read(self):
+        """
+            This method returns a copy of the newest complete frame in the same form as
+            latest(), or None if there are no frames yet.
+        """
+
+        while True:
+            frame = self.latest()
+
+            if frame is None:
+                return None
+
+            copy = {
+                'frame': frame['frame'],
+                'index': bytes(frame['index']),
+                'palette': bytes(frame['palette']),
+                'rgb': bytes(frame['rgb']) if frame['rgb'] is not None else None
+            }
+
+            frame['index'].release()
+            frame['palette'].release()
+
+            if frame['rgb'] is not None:
+                frame['rgb'].release()
+
+            if self.is_current(copy['frame']):
+                return copy
+
+            # The frame was overwritten while it was being copied.
+            self.retries += 1
+
+    def close(self):
+        """
+            This method unmaps the ring buffer.  Any views returned by latest() must have been
+            released first.
+        """
+
+        self.view.release()
+        self.ring.close()
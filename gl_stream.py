@@ -0,0 +1,366 @@
+"""
+    This module streams frames to OpenGL through pixel buffer objects (PBOs) and draws them as a
+    textured quad instead of calling glDrawPixels.
+
+    glDrawPixels is a synchronous, legacy path: the driver has to be finished with the pixels
+    before the call returns, and PyOpenGL may convert or copy the buffer before it gets that far.
+    With PBOs, the frame is copied once into memory owned by the driver and the texture upload
+    happens from there asynchronously.  Several PBOs are used in turn (double or triple
+    buffering) so writing the next frame never waits for the GPU to finish reading the last one.
+
+    Two ways of filling the PBO are supported:
+
+    * map: glMapBufferRange with GL_MAP_INVALIDATE_BUFFER_BIT and a single memmove from the
+      frame into the mapped memory.  This needs OpenGL 3.0 or ARB_map_buffer_range.
+
+    * orphan: glBufferData with no data (orphaning the old storage) followed by glBufferSubData.
+      This works on anything with OpenGL 1.5.
+
+    In both cases the frame is handed over without copying it in Python: bytearray and bytes
+    frames are passed by address through ctypes and NumPy frames through their data pointer.
+
+    The backend can be checked without a GPU by running under Mesa's software rasterizer
+    (LIBGL_ALWAYS_SOFTWARE=1).
+"""
+
+import ctypes
+import OpenGL.GL as gl
+
+def buffer_address(buf):
+    """
+        This function returns the address of the data in a bytes, bytearray, or NumPy buffer
+        along with an object that must be kept alive while the address is being used.
+    """
+
+    if hasattr(buf, 'ctypes'):
+        # NumPy array, which must be contiguous for the address to be meaningful.
+        if not buf.flags['C_CONTIGUOUS']:
+            raise ValueError('NumPy frames must be contiguous')
+
+        return buf.ctypes.data, buf
+
+    if isinstance(buf, bytes):
+        keep = ctypes.c_char_p(buf)
+
+        return ctypes.cast(keep, ctypes.c_void_p).value, keep
+
+    keep = (ctypes.c_char * len(buf)).from_buffer(buf)
+
+    return ctypes.addressof(keep), keep
+
+class TextureStreamer:
+    """
+        This class owns a texture and a ring of pixel buffer objects.  Call upload() with each
+        new RGB frame and draw() every time the window needs to be redrawn.  A frame that did
+        not change does not need to be uploaded again.
+    """
+
+    def __init__(self, width, height, buffers=3, mode='map'):
+        if mode == 'map' and not bool(gl.glMapBufferRange):
+            # The driver can't map buffer ranges, fall back to orphaning.
+            mode = 'orphan'
+
+        self.stream = {
+            'w': width,
+            'h': height,
+            'size': width * height * 3,
+            'mode': mode,
+            'index': 0,
+            'uploads': 0
+        }
+
+        # The rows are packed without padding.
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+
+        # Create the texture that the frames are copied into.
+        self.texture = gl.glGenTextures(1)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGB8, width, height, 0, gl.GL_RGB,
+                        gl.GL_UNSIGNED_BYTE, None)
+
+        # Create the pixel buffers.
+        self.pbos = [int(pbo) for pbo in gl.glGenBuffers(buffers)] if buffers > 1 \
+            else [int(gl.glGenBuffers(1))]
+
+        for pbo in self.pbos:
+            gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, pbo)
+            gl.glBufferData(gl.GL_PIXEL_UNPACK_BUFFER, self.stream['size'], None,
+                            gl.GL_STREAM_DRAW)
+
+        gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, 0)
+
+    def upload(self, frame):
+        """
+            This method copies an RGB frame into the next pixel buffer and starts the transfer
+            from there into the texture.
+        """
+
+        stream = self.stream
+        size = stream['size']
+
+        if getattr(frame, 'nbytes', len(frame)) != size:
+            raise ValueError(f'Expected a frame of {size} bytes')
+
+        address, keep = buffer_address(frame)
+
+        gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, self.pbos[stream['index']])
+
+        if stream['mode'] == 'map':
+            # Map the buffer, throwing away the old contents so the driver does not have to wait
+            # for them to be read, and copy the frame straight in.
+            pointer = gl.glMapBufferRange(gl.GL_PIXEL_UNPACK_BUFFER, 0, size,
+                                          gl.GL_MAP_WRITE_BIT | gl.GL_MAP_INVALIDATE_BUFFER_BIT)
+            ctypes.memmove(pointer, address, size)
+            gl.glUnmapBuffer(gl.GL_PIXEL_UNPACK_BUFFER)
+        else:
+            # Orphan the old storage and fill the new storage.
+            gl.glBufferData(gl.GL_PIXEL_UNPACK_BUFFER, size, None, gl.GL_STREAM_DRAW)
+            gl.glBufferSubData(gl.GL_PIXEL_UNPACK_BUFFER, 0, size, ctypes.c_void_p(address))
+
+        del keep
+
+        # Copy the pixel buffer into the texture.  With a buffer bound, the last argument is an
+        # offset into the buffer rather than a pointer.
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, 0, 0, stream['w'], stream['h'], gl.GL_RGB,
+                           gl.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+
+        gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, 0)
+
+        stream['index'] = (stream['index'] + 1) % len(self.pbos)
+        stream['uploads'] += 1
+
+    def draw(self):
+        """
+            This method draws the texture over the whole window.  The first row of the frame is
+            at the top, the same as the glDrawPixels path.
+        """
+
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glEnable(gl.GL_TEXTURE_2D)
+
+        gl.glBegin(gl.GL_QUADS)
+        gl.glTexCoord2f(0, 1)
+        gl.glVertex2f(-1, -1)
+        gl.glTexCoord2f(1, 1)
+        gl.glVertex2f(1, -1)
+        gl.glTexCoord2f(1, 0)
+        gl.glVertex2f(1, 1)
+        gl.glTexCoord2f(0, 0)
+        gl.glVertex2f(-1, 1)
+        gl.glEnd()
+
+        gl.glDisable(gl.GL_TEXTURE_2D)
+
+    def delete(self):
+        """ This method frees the texture and pixel buffers. """
+
+        gl.glDeleteBuffers(len(self.pbos), self.pbos)
+        gl.glDeleteTextures([self.texture])
+
+class LayerCompositor:
+    """
+        This class builds the frame on the GPU from layers instead of having the CPU build and
+        upload the whole window.
+
+        * The fire is uploaded once per frame as palette indices for the bottom band only.
+          OpenGL turns the indices into colors with its pixel maps as part of the upload, so the
+          CPU never colors the fire.  The band is drawn twice: once at the bottom and once at the
+          top, turned upside down and back to front.  Fire.render_frame reverses the band as
+          one run of pixels starting one pixel in, so each mirrored row is moved over by a
+          pixel and the first column comes from the next row down.  This is drawn as two quads
+          so the result matches exactly.
+
+        * The words are a texture of their own that is only uploaded when they change, which
+          only happens when the palette changes.
+
+        * Heat from the emitters above the band (see emitters.py) is uploaded as palette
+          indices as well, but only the rows that have heat in them and only while there are
+          any.  Index 0 is mapped to no alpha, so these rows are drawn over the mirrored fire
+          and the words with the alpha test and the pixels without heat are left alone, the
+          same as Fire.render_above.
+
+        * The palette is only sent when it changes.  During a crossfade that is once per frame,
+          which is 256 entries instead of a full frame.
+
+        Color index uploads are part of the compatibility profile that GoldFire already uses for
+        glDrawPixels and the immediate mode quads.
+    """
+
+    def __init__(self, width, height, first_row, logo_rect):
+        self.layers = {
+            'w': width,
+            'h': height,
+            'band_h': height - first_row,
+            'logo': logo_rect,
+            'palette': None,
+            'words': None,
+            'above_rows': 0,
+            'uploads': 0,
+            'uploaded_bytes': 0
+        }
+
+        # The rows are packed without padding.
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+
+        # Pixels without heat are transparent.  This only matters for the rows above the band,
+        # the other textures have no alpha.
+        gl.glPixelMapfv(gl.GL_PIXEL_MAP_I_TO_A, 256, [0.0] + [1.0] * 255)
+
+        self.fire_texture = make_texture(width, self.layers['band_h'])
+        self.logo_texture = make_texture(logo_rect[2], logo_rect[3])
+        self.above_texture = make_texture(width, first_row, gl.GL_RGBA8)
+
+    def set_palette(self, palette):
+        """
+            This method loads a palette of 256 red, green, and blue triplets into the pixel maps
+            unless it is the same palette as last time.
+        """
+
+        if palette is self.layers['palette']:
+            return
+
+        self.layers['palette'] = palette
+
+        for pixel_map, channel in ((gl.GL_PIXEL_MAP_I_TO_R, 0),
+                                   (gl.GL_PIXEL_MAP_I_TO_G, 1),
+                                   (gl.GL_PIXEL_MAP_I_TO_B, 2)):
+            gl.glPixelMapfv(pixel_map, 256, [value / 255 for value in palette[channel::3]])
+
+    def set_logo(self, words):
+        """
+            This method uploads the colored words unless they are the same words as last time.
+        """
+
+        if words is self.layers['words']:
+            return
+
+        self.layers['words'] = words
+
+        _, _, logo_w, logo_h = self.layers['logo']
+
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.logo_texture)
+        gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, 0, 0, logo_w, logo_h, gl.GL_RGB,
+                           gl.GL_UNSIGNED_BYTE, bytes(words))
+
+        self.layers['uploaded_bytes'] += len(words)
+
+    def upload_fire(self, band):
+        """
+            This method uploads the palette indices of the bottom band of the fire.  The current
+            palette must already have been set.
+        """
+
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.fire_texture)
+        gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, 0, 0, self.layers['w'], self.layers['band_h'],
+                           gl.GL_COLOR_INDEX, gl.GL_UNSIGNED_BYTE, band)
+
+        self.layers['uploads'] += 1
+        self.layers['uploaded_bytes'] += len(band)
+
+    def upload_above(self, rows):
+        """
+            This method uploads the palette indices of the rows just above the band that the
+            emitters have heated (nothing when there are none).  The current palette must
+            already have been set.
+        """
+
+        layers = self.layers
+        layers['above_rows'] = len(rows) // layers['w']
+
+        if not layers['above_rows']:
+            return
+
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.above_texture)
+        gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, 0, 0, layers['w'], layers['above_rows'],
+                           gl.GL_COLOR_INDEX, gl.GL_UNSIGNED_BYTE, rows)
+
+        layers['uploaded_bytes'] += len(rows)
+
+    def draw(self):
+        """ This method draws the layers over a black window. """
+
+        layers = self.layers
+        width, height = layers['w'], layers['h']
+
+        # Convert from rows and columns (with the first row at the top) to window coordinates.
+        band_top = 1 - 2 * (height - layers['band_h']) / height
+        mirror_bottom = 1 - 2 * layers['band_h'] / height
+        pixel_w, pixel_h = 2 / width, 2 / height
+
+        logo_x, logo_y, logo_w, logo_h = layers['logo']
+        left, right = 2 * logo_x / width - 1, 2 * (logo_x + logo_w) / width - 1
+        top, bottom = 1 - 2 * logo_y / height, 1 - 2 * (logo_y + logo_h) / height
+
+        gl.glClear(gl.GL_COLOR_BUFFER_BIT)
+        gl.glEnable(gl.GL_TEXTURE_2D)
+
+        # The fire at the bottom, the first row of the band at the top.
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.fire_texture)
+        draw_quad(-1, band_top, 1, -1, 0, 0, 1, 1)
+
+        # The mirrored fire at the top, upside down and back to front.  Columns 1 onwards show
+        # the last column of the band down to the second.
+        draw_quad(-1 + pixel_w, 1, 1, mirror_bottom, 1, 1, 1 / width, 0)
+
+        # Column 0 shows the first column of the band from the row below.  Its top pixel stays
+        # black.
+        draw_quad(-1, 1 - pixel_h, -1 + pixel_w, mirror_bottom - pixel_h, 0, 1, 1 / width, 0)
+
+        # The words.
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.logo_texture)
+        draw_quad(left, top, right, bottom, 0, 0, 1, 1)
+
+        if layers['above_rows']:
+            # The heat above the band, over everything else.  Only the pixels with heat pass
+            # the alpha test.
+            above_top = band_top + 2 * layers['above_rows'] / height
+
+            gl.glBindTexture(gl.GL_TEXTURE_2D, self.above_texture)
+            gl.glEnable(gl.GL_ALPHA_TEST)
+            gl.glAlphaFunc(gl.GL_GREATER, 0.5)
+            draw_quad(-1, above_top, 1, band_top, 0, 0, 1,
+                      layers['above_rows'] / (height - layers['band_h']))
+            gl.glDisable(gl.GL_ALPHA_TEST)
+
+        gl.glDisable(gl.GL_TEXTURE_2D)
+
+    def delete(self):
+        """ This method frees the textures. """
+
+        gl.glDeleteTextures([self.fire_texture, self.logo_texture, self.above_texture])
+
+def make_texture(width, height, internal_format=gl.GL_RGB8):
+    """ This function creates an empty texture (RGB unless given) without filtering. """
+
+    texture = gl.glGenTextures(1)
+    gl.glBindTexture(gl.GL_TEXTURE_2D, texture)
+    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
+    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
+    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
+    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
+    gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, internal_format, width, height, 0, gl.GL_RGB,
+                    gl.GL_UNSIGNED_BYTE, None)
+
+    return texture
+
+def draw_quad(left, top, right, bottom, s_left, t_top, s_right, t_bottom):
+    """
+        This function draws a textured quad.  The texture coordinates are given for the top-left
+        and bottom-right corners.
+    """
+
+    gl.glBegin(gl.GL_QUADS)
+    gl.glTexCoord2f(s_left, t_bottom)
+    gl.glVertex2f(left, bottom)
+    gl.glTexCoord2f(s_right, t_bottom)
+    gl.glVertex2f(right, bottom)
+    gl.glTexCoord2f(s_right, t_top)
+    gl.glVertex2f(right, top)
+    gl.glTexCoord2f(s_left, t_top)
+    gl.glVertex2f(left, top)
+    gl.glEnd()
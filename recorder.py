@@ -0,0 +1,247 @@
+"""
+    This module records GoldFire sessions to disk and plays them back.
+
+    The display hands each frame to the recorder as the back buffer plus the fire and word
+    palettes.  Only the compact form is kept: the palette indices of the bottom band of fire
+    (and of any rows above it that the emitters have heated), which are copied out of the back
+    buffer, and the palettes.  Everything else (the mirrored
+    band and the words) can be rebuilt from those.  The frames go through a bounded queue to a
+    writer thread that compresses them and appends them to the recording.  If the writer falls
+    behind and the queue is full, the frame is dropped and counted instead of making the display
+    wait.  If the writer fails, the error is kept in the stats and later frames are dropped.
+
+    A recording is a folder with:
+
+        recording.json   the size of the window and the first row of fire
+        palettes.bin     every distinct palette used, 768 bytes each, in order of first use
+        segment_N.gfr    the compressed frames, a new segment every segment_frames frames
+        index.bin        one fixed size entry per frame: frame number, time, segment, offset,
+                         length, fire palette, and word palette
+
+    The index makes it possible to seek straight to any frame.
+"""
+
+import json
+import os
+import queue
+import struct
+import threading
+import zlib
+from time import perf_counter
+
+# frame number, seconds since the start, segment, offset, length, fire palette, word palette
+INDEX = struct.Struct('<QdIQIII')
+
+PALETTE_SIZE = 768
+
+class Recorder:
+    """
+        This class records frames to a folder on a background thread.  record() never waits:
+        if the queue is full (or the writer has failed), the frame is dropped.
+    """
+
+    def __init__(self, path, width, height, first_row, queue_size=120, segment_frames=1800):
+        os.makedirs(path, exist_ok=True)
+
+        with open(os.path.join(path, 'recording.json'), 'w', encoding='utf-8') as meta_fh:
+            json.dump({'w': width, 'h': height, 'first_row': first_row,
+                       'segment_frames': segment_frames}, meta_fh)
+
+        self.path = path
+        self.segment_frames = segment_frames
+
+        # Where the bottom band of fire is in the back buffer.
+        self.width = width
+        self.band = (first_row * width, height * width)
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stopping = threading.Event()
+
+        self.stats = {
+            'start_time': perf_counter(),
+            'frames': 0,
+            'recorded': 0,
+            'dropped': 0,
+            'record_time': 0.0,
+            # The exception that stopped the writer, if any.
+            'error': None
+        }
+
+        self.writer = threading.Thread(target=self.write_frames, name='goldfire-recorder')
+        self.writer.start()
+
+    def record(self, back_buf, fire_palette, words_palette, top_row=None):
+        """
+            This method copies the band of fire out of the back buffer (a list or a bytearray)
+            and hands the frame to the writer.  If top_row is above the band, the band starts
+            there instead so the heat from the emitters is kept.  The time spent here, including the copy, is
+            added to the stats so the cost to the display can be measured.  It returns False if
+            the frame was dropped.
+        """
+
+        start_time = perf_counter()
+        stats = self.stats
+
+        # Don't bother copying a frame that would only be dropped.
+        queued = stats['error'] is None and not self.queue.full()
+
+        if queued:
+            start = self.band[0] if top_row is None else min(top_row * self.width,
+                                                              self.band[0])
+
+            try:
+                self.queue.put_nowait((stats['frames'], start_time - stats['start_time'],
+                                       bytes(back_buf[start:self.band[1]]),
+                                       fire_palette, words_palette))
+            except queue.Full:
+                # The writer is behind, drop the frame rather than wait.
+                queued = False
+
+        if not queued:
+            stats['dropped'] += 1
+
+        stats['frames'] += 1
+        stats['record_time'] += perf_counter() - start_time
+
+        return queued
+
+    def close(self, wait=True):
+        """
+            This method stops the recording.  The frames already in the queue are still
+            written.  With wait=False, the writer finishes on its own in the background.  It
+            returns the exception that stopped the writer, or None.
+        """
+
+        # The writer checks for this whenever the queue is empty, so it is never missed even if
+        # the queue is full or the writer has already stopped.
+        self.stopping.set()
+
+        if wait:
+            self.writer.join()
+
+        return self.stats['error']
+
+    def write_frames(self):
+        """ This method is the writer thread. """
+
+        try:
+            self.write_segments()
+        except Exception as error:
+            # Keep the error for record() and close() to report.  The frames that are still
+            # queued are lost.
+            self.stats['error'] = error
+
+    def write_segments(self):
+        """
+            This method writes the frames from the queue until the recording is stopped and
+            the queue is empty.
+        """
+
+        palettes = {}
+        segment_fh = None
+        segment = -1
+
+        try:
+            with open(os.path.join(self.path, 'index.bin'), 'wb') as index_fh, \
+                    open(os.path.join(self.path, 'palettes.bin'), 'wb') as palette_fh:
+                while True:
+                    try:
+                        item = self.queue.get(timeout=0.1)
+                    except queue.Empty:
+                        if self.stopping.is_set():
+                            break
+
+                        continue
+
+                    frame, timestamp, band, fire_palette, words_palette = item
+
+                    palette_ids = []
+
+                    for palette in (fire_palette, words_palette):
+                        palette = bytes(palette)
+
+                        if palette not in palettes:
+                            # The first time a palette is seen, add it to the palette file.
+                            palettes[palette] = len(palettes)
+                            palette_fh.write(palette)
+
+                        palette_ids.append(palettes[palette])
+
+                    if self.stats['recorded'] % self.segment_frames == 0:
+                        # Start a new segment.
+                        if segment_fh:
+                            segment_fh.close()
+
+                        segment += 1
+                        segment_fh = open(os.path.join(self.path, f'segment_{segment}.gfr'),
+                                          'wb')
+
+                    data = zlib.compress(band, 1)
+
+                    index_fh.write(INDEX.pack(frame, timestamp, segment, segment_fh.tell(),
+                                              len(data), *palette_ids))
+                    segment_fh.write(data)
+
+                    self.stats['recorded'] += 1
+        finally:
+            if segment_fh:
+                segment_fh.close()
+
+class Recording:
+    """
+        This class reads a recording made by Recorder.  Frames can be read in order or by
+        position.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(os.path.join(path, 'recording.json'), encoding='utf-8') as meta_fh:
+            self.meta = json.load(meta_fh)
+
+        with open(os.path.join(path, 'palettes.bin'), 'rb') as palette_fh:
+            data = palette_fh.read()
+
+        self.palettes = [data[start:start + PALETTE_SIZE]
+                         for start in range(0, len(data), PALETTE_SIZE)]
+
+        with open(os.path.join(path, 'index.bin'), 'rb') as index_fh:
+            self.index = list(INDEX.iter_unpack(index_fh.read()))
+
+        self.segments = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def frame(self, position):
+        """
+            This method returns the frame at a position in the recording as a dict of the frame
+            number, the time, the band of palette indices, the fire palette, and the word
+            palette.  Frame numbers skip where frames were dropped.
+        """
+
+        frame, timestamp, segment, offset, length, fire_id, words_id = self.index[position]
+
+        if segment not in self.segments:
+            # Keep the segments open, a replay reads them in order.
+            self.segments[segment] = open(os.path.join(self.path, f'segment_{segment}.gfr'),
+                                          'rb')
+
+        segment_fh = self.segments[segment]
+        segment_fh.seek(offset)
+
+        return {
+            'frame': frame,
+            'time': timestamp,
+            'band': zlib.decompress(segment_fh.read(length)),
+            'fire_palette': self.palettes[fire_id],
+            'words_palette': self.palettes[words_id]
+        }
+
+    def close(self):
+        """ This method closes the open segments. """
+
+        for segment_fh in self.segments.values():
+            segment_fh.close()
+
+        self.segments = {}
@@ -0,0 +1,347 @@
+"""
+    This program runs GoldFire for a long time and watches for slow memory leaks and for the
+    frame time drifting upwards.  It is meant for the nightly runs that gate builds: the exit
+    status is non-zero if memory or latency grew faster than the thresholds.
+
+    By default the fire runs headless (no window) as fast as it can.  With --windowed, the
+    normal GLUT window is used and the monitor is fed from the display callback instead.
+
+    At every interval a sample is appended to the log as a line of JSON:
+
+        t         seconds since the start
+        frames    frames since the start
+        rss_kb    resident set size (None if it can't be read on this platform)
+        heap_kb   memory allocated by Python according to tracemalloc (None without
+                  --tracemalloc)
+        top       the biggest allocators according to tracemalloc (file:line and KB)
+        gc        the number of objects in each garbage collector generation
+        collected the number of collections of each garbage collector generation so far
+        p50, p95, p99, max
+                  frame time percentiles in milliseconds over the last window of frames
+
+    When the run is over, the slopes of the memory and frame time samples are calculated (after
+    the warm up period) and compared to the thresholds.  tracemalloc is off unless --tracemalloc
+    is given since it makes every frame many times slower.  When it is on, the frame time
+    trends are still printed but are not checked against the thresholds, since they would
+    measure tracemalloc rather than the renderer.
+
+    Example (one hour, headless, a sample every 30 seconds):
+
+        python soak.py --seconds 3600 --interval 30 --log soak.jsonl
+"""
+
+import argparse
+import collections
+import gc
+import json
+import os
+import sys
+import tracemalloc
+from time import perf_counter
+
+from stats import percentile, slope
+
+def read_rss_kb():
+    """
+        This function returns the resident set size of the process in KB, or None if it can't
+        be read on this platform.
+    """
+
+    try:
+        with open('/proc/self/statm', 'rb') as statm_fh:
+            pages = int(statm_fh.read().split()[1])
+
+        return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import resource
+
+        # This is the peak rather than the current size, but it still shows growth.
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        return usage // 1024 if sys.platform == 'darwin' else usage
+    except ImportError:
+        return None
+
+class SoakMonitor:
+    """
+        This class collects the samples for a soak run.  Call frame() with the duration of each
+        frame and check done() to find out when the run is over.
+    """
+
+    def __init__(self, options):
+        self.options = options
+
+        self.state = {
+            'start_time': None,
+            'next_sample': 0.0,
+            'frames': 0,
+            'window': collections.deque(maxlen=options.window),
+            'samples': []
+        }
+
+        self.log = open(options.log, 'w', encoding='utf-8') if options.log else None
+
+        if options.tracemalloc:
+            tracemalloc.start()
+
+    def start(self):
+        """ This method starts the clock for the run. """
+
+        self.state['start_time'] = perf_counter()
+        self.state['next_sample'] = self.options.interval
+
+    def frame(self, frame_time):
+        """ This method records the time one frame took, in seconds. """
+
+        state = self.state
+
+        state['frames'] += 1
+        state['window'].append(frame_time)
+
+        if perf_counter() - state['start_time'] >= state['next_sample']:
+            self.sample()
+            state['next_sample'] += self.options.interval
+
+    def done(self):
+        """ This method returns True once the duration or frame count has been reached. """
+
+        options, state = self.options, self.state
+
+        if options.frames and state['frames'] >= options.frames:
+            return True
+
+        return bool(options.seconds) and perf_counter() - state['start_time'] >= options.seconds
+
+    def sample(self):
+        """ This method takes a sample and appends it to the log. """
+
+        state = self.state
+        ordered = sorted(state['window'])
+
+        sample = {
+            't': round(perf_counter() - state['start_time'], 3),
+            'frames': state['frames'],
+            'rss_kb': read_rss_kb(),
+            'heap_kb': None,
+            'top': None,
+            'gc': gc.get_count(),
+            'collected': [stats['collections'] for stats in gc.get_stats()],
+            'p50': round(percentile(ordered, 0.50) * 1000, 3),
+            'p95': round(percentile(ordered, 0.95) * 1000, 3),
+            'p99': round(percentile(ordered, 0.99) * 1000, 3),
+            'max': round(ordered[-1] * 1000, 3) if ordered else 0.0
+        }
+
+        if tracemalloc.is_tracing():
+            sample['heap_kb'] = tracemalloc.get_traced_memory()[0] // 1024
+
+            # Leave out the allocations made by tracemalloc and the monitor themselves.
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__)))
+
+            sample['top'] = [
+                [f'{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}',
+                 stat.size // 1024]
+                for stat in snapshot.statistics('lineno')[:self.options.top]]
+
+        state['samples'].append(sample)
+
+        if self.log:
+            self.log.write(json.dumps(sample, separators=(',', ':')) + '\n')
+            self.log.flush()
+
+    def report(self):
+        """
+            This method takes a final sample, prints the trends, and returns True if they are
+            within the thresholds.
+        """
+
+        options = self.options
+
+        self.sample()
+
+        if self.log:
+            self.log.close()
+
+        samples = [sample for sample in self.state['samples'] if sample['t'] >= options.warmup]
+
+        print(f'Frames: {self.state["frames"]}')
+        print(f'Seconds: {self.state["samples"][-1]["t"]}')
+        print(f'Samples after warm up: {len(samples)}')
+
+        if len(samples) < 3:
+            print('Not enough samples after the warm up to calculate trends')
+
+            return True
+
+        # Slopes per hour.
+        trends = {
+            'rss_kb': slope([(sample['t'], sample['rss_kb']) for sample in samples
+                             if sample['rss_kb'] is not None]) * 3600,
+            'heap_kb': slope([(sample['t'], sample['heap_kb']) for sample in samples
+                              if sample['heap_kb'] is not None]) * 3600,
+            'p95': slope([(sample['t'], sample['p95']) for sample in samples]) * 3600
+        }
+
+        drift = samples[-1]['p95'] / samples[0]['p95'] if samples[0]['p95'] else 1.0
+
+        print(f'RSS growth: {trends["rss_kb"]:.1f} KB / hour '
+              f'(limit {options.max_rss_slope} KB / hour)')
+        print(f'Python heap growth: {trends["heap_kb"]:.1f} KB / hour')
+        print(f'p95 frame time trend: {trends["p95"]:.3f} ms / hour '
+              f'(limit {options.max_p95_slope} ms / hour)')
+        print(f'p95 frame time: {samples[0]["p95"]} ms -> {samples[-1]["p95"]} ms '
+              f'(x{drift:.2f}, limit x{options.max_p95_ratio})')
+
+        if samples[-1]['top']:
+            print('Top allocators at the end:')
+
+            for location, size in samples[-1]['top']:
+                print(f'    {location}: {size} KB')
+
+        failures = []
+
+        if trends['rss_kb'] > options.max_rss_slope or \
+                trends['heap_kb'] > options.max_rss_slope:
+            failures.append('memory')
+
+        if options.tracemalloc:
+            print('Frame time thresholds not checked while tracing allocations')
+        elif trends['p95'] > options.max_p95_slope or drift > options.max_p95_ratio:
+            failures.append('frame time')
+
+        if failures:
+            print(f'FAILED: {" and ".join(failures)} drifted past the thresholds')
+
+            return False
+
+        print('PASSED')
+
+        return True
+
+def run_headless(fire, monitor, options):
+    """
+        This function advances and renders the fire as fast as it can until the monitor says
+        the run is over.
+    """
+
+    monitor.start()
+
+    while not monitor.done():
+        start_time = perf_counter()
+
+        if options.palette_every and not monitor.state['frames'] % options.palette_every:
+            # Change the palette now and then so the crossfades are part of the run.
+            fire.kb_input(b'p', 0, 0)
+            fire.apply_keys()
+
+        fire.step_fire()
+        fire.render_frame()
+
+        # There is no window, so key presses count as presented once they are rendered.
+        # Otherwise they would pile up waiting for a frame that is never displayed.
+        fire.trace_keys(perf_counter())
+
+        monitor.frame(perf_counter() - start_time)
+
+    return monitor.report()
+
+def run_windowed(fire, monitor, options):
+    """
+        This function runs the normal GLUT window and feeds the monitor from the display
+        callback.  Only the frames that were rendered are timed.  The window is closed when the
+        run is over.
+    """
+
+    import OpenGL.GLUT as glut
+
+    display_frame = fire.display_frame
+    frame_state = fire.frame_state
+
+    def soak_frame():
+        start_time, renders = perf_counter(), frame_state.renders
+
+        display_frame()
+
+        if frame_state.renders == renders:
+            # The last frame was kept (or only repainted) while waiting for the next step, so
+            # there was no frame time to measure.
+            return
+
+        if options.palette_every and not monitor.state['frames'] % options.palette_every:
+            fire.kb_input(b'p', 0, 0)
+
+        monitor.frame(perf_counter() - start_time)
+
+        if monitor.done():
+            passed = monitor.report()
+            glut.glutDestroyWindow(fire.handle)
+
+            # Exceptions (including SystemExit) do not make it out of a GLUT callback, so exit
+            # directly with the result.
+            sys.stdout.flush()
+            os._exit(0 if passed else 1)
+
+    # Replace the display callback before the window is created so GLUT uses the wrapper.
+    fire.display_frame = soak_frame
+
+    monitor.start()
+    fire.main()
+
+    # The window was closed before the run was over.
+    return monitor.report()
+
+def parse_args():
+    """ This function parses the command line arguments. """
+
+    parser = argparse.ArgumentParser(description='GoldFire soak test')
+    parser.add_argument('--seconds', type=float, default=3600,
+                        help='length of the run in seconds (0 for no limit)')
+    parser.add_argument('--frames', type=int, default=0,
+                        help='length of the run in frames (0 for no limit)')
+    parser.add_argument('--interval', type=float, default=30, help='seconds between samples')
+    parser.add_argument('--warmup', type=float, default=60,
+                        help='seconds at the start that are left out of the trends')
+    parser.add_argument('--window', type=int, default=1000,
+                        help='frames used for the frame time percentiles')
+    parser.add_argument('--top', type=int, default=5, help='number of top allocators logged')
+    parser.add_argument('--log', default='soak.jsonl', help='file the samples are written to')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='trace Python allocations (this slows the frames down a lot, so the '
+                             'frame time thresholds are not checked)')
+    parser.add_argument('--max-rss-slope', type=float, default=1024,
+                        help='largest allowed memory growth in KB / hour')
+    parser.add_argument('--max-p95-slope', type=float, default=1.0,
+                        help='largest allowed p95 frame time growth in ms / hour')
+    parser.add_argument('--max-p95-ratio', type=float, default=1.25,
+                        help='largest allowed ratio of the last p95 frame time to the first')
+    parser.add_argument('--palette-every', type=int, default=0,
+                        help='change the palette every N frames (0 to leave it alone)')
+    parser.add_argument('--windowed', action='store_true', help='use the GLUT window')
+    parser.add_argument('--backend', choices=['pixels', 'pbo', 'composite'], default='pixels',
+                        help='how frames are sent to OpenGL in a window')
+    parser.add_argument('--engine', choices=['python', 'stdlib', 'threads'], default='python',
+                        help='how the fire is advanced and colored (see fire_demo.py)')
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1,
+                        help='number of threads used by the threads engine')
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    from fire_demo import Fire
+
+    ARGS = parse_args()
+    MONITOR = SoakMonitor(ARGS)
+
+    FIRE = Fire(backend=ARGS.backend, engine=ARGS.engine, threads=ARGS.threads)
+
+    if ARGS.windowed:
+        PASSED = run_windowed(FIRE, MONITOR, ARGS)
+    else:
+        PASSED = run_headless(FIRE, MONITOR, ARGS)
+
+    sys.exit(0 if PASSED else 1)
@@ -0,0 +1,111 @@
+"""
+    This module holds the state that the frame path reads: the geometry of the window, which
+    is worked out once when the size is picked, and the counters and clock that change every
+    frame.
+
+    Both are classes with __slots__ instead of dicts.  An attribute in a slot is read straight
+    from a fixed offset in the object instead of by hashing a string key, and every offset and
+    length that the frame path needs is calculated here once instead of once (or once per row)
+    per frame.  A Geometry can't be changed: a new size (or aspect) builds a new one.
+"""
+
+# The fire cuts out on its own about this many rows above the random data, so the band of fire
+# is the same height at every size.
+FIRE_ROWS = 55
+
+# The logo is this many rows high.
+LOGO_ROWS = 20
+
+class Geometry:
+    """
+        This class holds the size of the window and where the fire, the mirrored fire, and the
+        logo go in the back and display buffers.  Offsets into the display buffer (which has
+        three bytes per pixel) end in _bytes or are in logo_rows.
+    """
+
+    __slots__ = ('w', 'h', 'size', 'first_row', 'start_from', 'end_from', 'mirror_from',
+                 'logo_cols', 'logo_bytes', 'logo_start_row', 'logo_start_col', 'logo_rect',
+                 'logo_rows', 'fire_start', 'fire_end')
+
+    def __init__(self, width, height, logo_cols):
+        first_row = height - FIRE_ROWS
+
+        # The logo is centered between the top of the mirrored fire and the first row of fire.
+        logo_start_row = height - first_row + ((first_row - (height - first_row) - LOGO_ROWS)
+                                               >> 1)
+        logo_start_col = (width - logo_cols) // 2
+
+        self.w = width
+        self.h = height
+        self.size = width * height
+        self.first_row = first_row
+        self.start_from = first_row * width
+        self.end_from = height * width
+        # The pixel of the mirrored band that matches the first pixel of the fire.
+        self.mirror_from = (height - first_row) * width
+        self.logo_cols = logo_cols
+        self.logo_bytes = logo_cols * 3
+        self.logo_start_row = logo_start_row
+        self.logo_start_col = logo_start_col
+        self.logo_rect = (logo_start_col, logo_start_row, logo_cols, LOGO_ROWS)
+        # The offsets of each row of the logo in the display buffer and in the words.
+        self.logo_rows = tuple(((logo_start_row + row) * width * 3 + logo_start_col * 3,
+                                row * logo_cols * 3) for row in range(LOGO_ROWS))
+        # The rows of fire the logo is burnt into (A), the same place in the band of fire at
+        # every size.
+        self.fire_start = first_row + 32
+        self.fire_end = first_row + 32 + LOGO_ROWS
+
+    def __setattr__(self, name, value):
+        # Each slot can be set once, in __init__.
+        if hasattr(self, name):
+            raise AttributeError(f'{type(self).__name__} can not be changed, build a new one')
+
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} can not be changed, build a new one')
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.w}, {self.h}, {self.logo_cols})'
+
+    def resized(self, width, height):
+        """ This method returns the geometry for a new size with the same logo. """
+
+        return Geometry(width, height, self.logo_cols)
+
+class FrameState:
+    """
+        This class holds the counters for the FPS statistics, the fixed timestep clock, and the
+        flags that decide whether a frame has to be rendered or drawn.  A rate of 0 (or None)
+        advances the fire one step per displayed frame.
+    """
+
+    __slots__ = ('start_time', 'frames', 'rate', 'step', 'last_time', 'lag', 'max_steps',
+                 'steps', 'renders', 'reused', 'dropped', 'damaged', 'waiting',
+                 'palette_changed')
+
+    def __init__(self, sim_rate):
+        self.start_time = None
+        self.frames = 0
+
+        self.rate = sim_rate or 0
+        self.step = 1.0 / sim_rate if sim_rate else 0.0
+        self.last_time = None
+        self.lag = 0.0
+        self.max_steps = 5
+
+        self.steps = 0
+        self.renders = 0
+        self.reused = 0
+        self.dropped = 0
+
+        # Set when the window has to be repainted even though the frame didn't change.
+        self.damaged = True
+
+        # Set while the display waits on a timer for the next step.
+        self.waiting = False
+
+        # Set when the palettes changed, so the words have to be rebuilt and the frame
+        # rendered again.
+        self.palette_changed = True
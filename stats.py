@@ -0,0 +1,31 @@
+"""
+    This module contains the small statistics helpers shared by GoldFire and its tools.
+"""
+
+def percentile(ordered, fraction):
+    """ This function returns a percentile of an already sorted list. """
+
+    if not ordered:
+        return 0.0
+
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def slope(points):
+    """
+        This function returns the least squares slope of a list of (x, y) points, or 0 if there
+        are not enough points.
+    """
+
+    if len(points) < 2:
+        return 0.0
+
+    count = len(points)
+    mean_x = sum(point[0] for point in points) / count
+    mean_y = sum(point[1] for point in points) / count
+
+    spread = sum((point[0] - mean_x) ** 2 for point in points)
+
+    if not spread:
+        return 0.0
+
+    return sum((point[0] - mean_x) * (point[1] - mean_y) for point in points) / spread
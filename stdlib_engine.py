@@ -0,0 +1,139 @@
+"""
+    This module is a version of the fire routine that only uses the standard library and does
+    its work a whole row (or a whole band) at a time instead of a pixel at a time.  It is meant
+    for targets that can't ship NumPy, but it is also several times faster than the pixel loops.
+
+    The heat field is kept in a bytearray (the back buffer) the same as the pixel loops.
+
+    Averaging: each row is spread out into a Python integer with 16 bits per pixel (a lane),
+    which is done with an extended slice and int.from_bytes.  The pixels to the left and right
+    are then a shift (and a wrap of one lane) away, so a whole row is averaged with a handful of
+    big integer additions, shifts, and masks.  The lanes are wide enough that the sums never
+    carry into the next pixel.  Like the cache in fire_demo.py, the four values are added and
+    shifted in two pairs.
+
+    Coloring: a palette is split into three 256 byte tables (red, green, and blue).
+    bytes.translate turns a whole band of palette indices into one color plane at a time and
+    the planes are interleaved into the display buffer with extended slice assignments.
+"""
+
+import random
+
+def channel_tables(palette):
+    """
+        This function splits a palette of red, green, and blue triplets into three translation
+        tables, one for each color.
+    """
+
+    return bytes(palette[0::3]), bytes(palette[1::3]), bytes(palette[2::3])
+
+def colorize(indices, palette):
+    """
+        This function turns a buffer of palette indices into a buffer of red, green, and blue
+        triplets.
+    """
+
+    red, green, blue = channel_tables(palette)
+
+    rgb_buf = bytearray(len(indices) * 3)
+    rgb_buf[0::3], rgb_buf[1::3], rgb_buf[2::3] \
+        = indices.translate(red), indices.translate(green), indices.translate(blue)
+
+    return rgb_buf
+
+class StdlibEngine:
+    """
+        This class advances and colors the fire for a window of the given geometry (see
+        state.py) using only the standard library.  The back buffer must be a bytearray.
+    """
+
+    def __init__(self, geometry):
+        self.geometry = geometry
+        width = geometry.w
+
+        # The mask keeps the low 14 bits of every lane, which throws away the bits shifted in
+        # from the lane above.  The shift moves a lane from one end of a row to the other.
+        self.lanes = {
+            'buf': bytearray(width + width),
+            'full': (1 << (16 * width)) - 1,
+            'mask': int.from_bytes(b'\xff\x3f' * width, 'little'),
+            'shift': 16 * (width - 1)
+        }
+
+    def spread(self, row):
+        """ This method spreads a row of bytes out into a 16 bit per pixel integer. """
+
+        lanes = self.lanes['buf']
+        lanes[0::2] = row
+
+        return int.from_bytes(lanes, 'little')
+
+    def average(self, below, two_below):
+        """
+            This method calculates a whole row of the fire from the two rows below it (as
+            spread out integers).  The pixels at either end wrap around to the other end.
+        """
+
+        lanes = self.lanes
+        full, mask, shift = lanes['full'], lanes['mask'], lanes['shift']
+
+        left = ((below << 16) & full) | (below >> shift)
+        right = (below >> 16) | ((below & 0xFFFF) << shift)
+
+        return (((left + right) >> 2) & mask) + (((below + two_below) >> 2) & mask)
+
+    def step(self, back_buf):
+        """
+            This method advances the fire by one step.  As in the pixel loops, the bottom row
+            of fire is calculated from two rows of random data and the rows above it from the
+            previous step.
+        """
+
+        # Make local copies to avoid the overhead of lookups.
+        geometry, spread, average = self.geometry, self.spread, self.average
+        window_w, first_row, height = geometry.w, geometry.first_row, geometry.h
+
+        # Spread out the rows that are read before any of them change.
+        rows = [spread(back_buf[row * window_w:row * window_w + window_w])
+                for row in range(first_row + 1, height)]
+
+        start = first_row * window_w
+
+        for index in range(0, len(rows) - 1):
+            back_buf[start:start + window_w] \
+                = average(rows[index], rows[index + 1]).to_bytes(window_w + window_w,
+                                                                 'little')[0::2]
+
+            start += window_w
+
+        # Generate two rows of values at either the min or halfway value of the palette.  The
+        # next to last row comes from these.  The last row is never drawn.
+        random_bytes = bytes(random.choices((0, 128), (43, 57), k=window_w + window_w))
+
+        back_buf[start:start + window_w] \
+            = average(spread(random_bytes[:window_w]),
+                      spread(random_bytes[window_w:])).to_bytes(window_w + window_w,
+                                                                'little')[0::2]
+
+    def colorize(self, display_buf, back_buf, palette):
+        """
+            This method colors the band of fire into the display buffer at the bottom and
+            mirrored at the top, the same as the pixel loop in Fire.render_frame.
+        """
+
+        start_from, end_from = self.geometry.start_from, self.geometry.end_from
+
+        red, green, blue = channel_tables(palette)
+
+        band = back_buf[start_from:end_from]
+        mirrored = band[::-1]
+
+        # The band at the bottom.
+        start, end = start_from * 3, end_from * 3
+        display_buf[start:end:3], display_buf[start + 1:end:3], display_buf[start + 2:end:3] \
+            = band.translate(red), band.translate(green), band.translate(blue)
+
+        # The mirrored band at the top, which starts one pixel in.
+        end = (len(band) + 1) * 3
+        display_buf[3:end:3], display_buf[4:end:3], display_buf[5:end:3] \
+            = mirrored.translate(red), mirrored.translate(green), mirrored.translate(blue)
@@ -0,0 +1,276 @@
+"""
+    This module is a version of the fire routine that splits each frame into horizontal bands
+    and works on them with a pool of threads, all in the same process so no buffer is ever
+    copied between processes.
+
+    Each frame has three independent kinds of work:
+
+    * simulating the band of fire,
+    * building the logo layer (copying the colored words into the frame),
+    * coloring the fire and mirroring it to the top of the frame.
+
+    Each of these is split into bands and every thread takes one band of each.  The threads are
+    started once and wait on a barrier between phases, so there is no per-frame cost for
+    creating threads or tasks.
+
+    The work is done with NumPy operations on views of the same bytearrays that the rest of
+    GoldFire uses.  On standard CPython these operations release the GIL while they run, so the
+    bands run in parallel as long as they are big enough.  On free-threaded (no GIL) builds, the
+    Python code between the operations runs in parallel as well.
+"""
+
+import sys
+import threading
+
+import numpy as np
+
+# Held in the frame between frames so no buffer is kept alive (or locked against resizing).
+EMPTY = np.zeros((0, 0), dtype=np.uint8)
+
+def gil_enabled():
+    """ This function returns False when running on a free-threaded build with the GIL off. """
+
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+
+    return True if is_gil_enabled is None else is_gil_enabled()
+
+def split(start, stop, index, count):
+    """ This function returns the part of a range that belongs to one of count bands. """
+
+    size = stop - start
+
+    return start + size * index // count, start + size * (index + 1) // count
+
+class ThreadedEngine:
+    """
+        This class advances and colors the fire for a window of the given geometry (see
+        state.py) with a pool of threads.  The back buffer must be a bytearray.  The calling
+        thread does the first band itself, so threads=1 runs everything on the calling thread.
+    """
+
+    def __init__(self, geometry, threads=4):
+        self.geometry = geometry
+        width = geometry.w
+
+        # The rows that are read by the simulation are copied here first so the bands can be
+        # written in any order.  The scratch arrays hold the sums for each band.
+        rows = geometry.h - geometry.first_row - 1
+        self.source = np.zeros((rows, width), dtype=np.uint8)
+        self.scratch = [(np.empty((rows, width), dtype=np.uint16),
+                         np.empty((rows, width), dtype=np.uint16),
+                         np.empty((rows, width), dtype=np.uint16)) for _ in range(threads)]
+
+        # The buffers and palette for the frame being worked on.
+        self.frame = {
+            'heat': EMPTY,
+            'display': EMPTY,
+            'palette': EMPTY,
+            'words': EMPTY,
+            'random': EMPTY
+        }
+
+        self.pool = {
+            'threads': threads,
+            'phases': (),
+            'barrier': threading.Barrier(threads),
+            # Used to bring every thread back in step after a phase raised an exception.
+            'recover': threading.Barrier(threads),
+            'errors': [],
+            'stop': False,
+            'workers': []
+        }
+
+        for index in range(1, threads):
+            worker = threading.Thread(target=self.work, args=(index,), daemon=True,
+                                      name=f'goldfire-band-{index}')
+            worker.start()
+            self.pool['workers'].append(worker)
+
+    def work(self, index):
+        """ This method is the loop that each worker thread runs. """
+
+        pool = self.pool
+
+        while True:
+            try:
+                # Wait for the next frame.
+                pool['barrier'].wait()
+
+                if pool['stop']:
+                    return
+
+                for phase in pool['phases']:
+                    phase(index)
+                    pool['barrier'].wait()
+            except Exception as error:
+                if not isinstance(error, threading.BrokenBarrierError):
+                    # Hand the error to the calling thread and stop the frame.
+                    pool['errors'].append(error)
+                    pool['barrier'].abort()
+
+                # Wait for every thread to give up on the frame, then for the barrier to be
+                # reset before waiting for the next frame.
+                pool['recover'].wait()
+                pool['recover'].wait()
+
+    def run(self, phases):
+        """
+            This method runs the phases on every band, with a barrier after each phase, and
+            returns when they are all done.
+        """
+
+        pool = self.pool
+        pool['phases'] = phases
+
+        if pool['threads'] == 1:
+            for phase in phases:
+                phase(0)
+
+            return
+
+        try:
+            # Release the workers.
+            pool['barrier'].wait()
+
+            for phase in phases:
+                phase(0)
+                pool['barrier'].wait()
+        except Exception as error:
+            # A band failed.  Stop the frame on every thread, wait until they have all given up
+            # on it, and reset the barrier so the next frame starts in step.
+            pool['barrier'].abort()
+            pool['recover'].wait()
+            pool['barrier'].reset()
+            pool['recover'].wait()
+
+            errors, pool['errors'] = pool['errors'], []
+
+            if errors and isinstance(error, threading.BrokenBarrierError):
+                # The error came from one of the workers.
+                raise errors[0] from None
+
+            raise
+
+    def step(self, back_buf):
+        """ This method advances the fire by one step. """
+
+        geometry = self.geometry
+
+        self.frame['heat'] = np.frombuffer(back_buf, dtype=np.uint8).reshape(geometry.h,
+                                                                             geometry.w)
+        self.frame['random'] = np.random.choice(
+            np.array([0, 128], dtype=np.uint8), size=(2, geometry.w), p=[0.43, 0.57])
+
+        self.run((self.copy_band, self.average_band))
+
+        self.frame['heat'] = EMPTY
+
+    def copy_band(self, index):
+        """ This method copies a band of the rows that the simulation reads. """
+
+        start, stop = split(0, len(self.source), index, self.pool['threads'])
+        first_row = self.geometry.first_row
+
+        self.source[start:stop] = self.frame['heat'][first_row + 1 + start:first_row + 1 + stop]
+
+    def average_band(self, index):
+        """
+            This method calculates a band of rows from the two rows below each of them.  The
+            band that ends at the bottom also calculates the next to last row from the random
+            data.  The last row is never drawn.
+        """
+
+        heat, source = self.frame['heat'], self.source
+        first_row, height = self.geometry.first_row, self.geometry.h
+
+        # The rows first_row to h - 3 are calculated from the source rows, row h - 2 from the
+        # random data.
+        start, stop = split(0, len(source) - 1, index, self.pool['threads'])
+        left, right, total = self.scratch[index]
+
+        average(source[start:stop], source[start + 1:stop + 1], heat[first_row + start:
+                                                                     first_row + stop],
+                left[:stop - start], right[:stop - start], total[:stop - start])
+
+        if index == self.pool['threads'] - 1:
+            random_rows = self.frame['random']
+
+            average(random_rows[0:1], random_rows[1:2], heat[height - 2:height - 1],
+                    left[:1], right[:1], total[:1])
+
+    def render(self, display_buf, back_buf, palette, words_buf):
+        """
+            This method builds the frame in the display buffer: the logo layer, the band of
+            fire at the bottom, and the band mirrored at the top.
+        """
+
+        geometry, frame = self.geometry, self.frame
+
+        frame['heat'] = np.frombuffer(back_buf, dtype=np.uint8)
+        frame['display'] = np.frombuffer(display_buf, dtype=np.uint8).reshape(-1, 3)
+        frame['palette'] = np.frombuffer(bytes(palette), dtype=np.uint8).reshape(256, 3)
+        frame['words'] = np.frombuffer(words_buf, dtype=np.uint8).reshape(
+            geometry.logo_rect[3], -1)
+
+        self.run((self.render_band,))
+
+        frame['heat'] = frame['display'] = frame['words'] = EMPTY
+
+    def render_band(self, index):
+        """ This method builds one band of the logo layer and of the fire. """
+
+        geometry, frame = self.geometry, self.frame
+        threads = self.pool['threads']
+
+        display, heat = frame['display'], frame['heat']
+        start_from, end_from = geometry.start_from, geometry.end_from
+
+        # The logo layer.
+        start_col, start_row, logo_cols, logo_rows = geometry.logo_rect
+        display_rows = display.reshape((geometry.h, geometry.w, 3))
+        start, stop = split(0, logo_rows, index, threads)
+
+        display_rows[start_row + start:start_row + stop, start_col:start_col + logo_cols] \
+            = frame['words'][start:stop].reshape(stop - start, logo_cols, 3)
+
+        # The fire at the bottom and mirrored at the top, which starts one pixel in.  Each
+        # thread mirrors the pixels it colored.
+        start, stop = split(0, end_from - start_from, index, threads)
+        band = display[start_from + start:start_from + stop]
+
+        np.take(frame['palette'], heat[start_from + start:start_from + stop], axis=0, out=band)
+
+        length = end_from - start_from
+        display[length - stop + 1:length - start + 1] = band[::-1]
+
+    def close(self):
+        """ This method stops the worker threads. """
+
+        if self.pool['threads'] > 1:
+            self.pool['stop'] = True
+            self.pool['barrier'].wait()
+
+            for worker in self.pool['workers']:
+                worker.join()
+
+def average(below, two_below, out, left, right, total):
+    """
+        This function calculates rows of fire from the rows below them, using the scratch
+        arrays for the sums.  The pixels at either end of a row wrap around within the row.
+        Like the cache in fire_demo.py, the four values are added and shifted in two pairs.
+    """
+
+    # The pixels to the left and right.  The sums are done in 16 bits so they don't wrap.
+    left[:, 1:] = below[:, :-1]
+    left[:, 0] = below[:, -1]
+    right[:, :-1] = below[:, 1:]
+    right[:, -1] = below[:, 0]
+
+    np.add(left, right, out=total)
+    np.right_shift(total, 2, out=total)
+
+    np.add(below, two_below, out=left, dtype=np.uint16)
+    np.right_shift(left, 2, out=left)
+
+    np.add(total, left, out=total)
+    np.copyto(out, total, casting='unsafe')